@@ -0,0 +1,171 @@
+"""
+Gunicorn configuration
+
+Sizes the workers of the service from the cores and the memory the
+container may actually use (the cgroup limits, not the host's), so the
+same image scales from a laptop to a production pod. Every setting can
+be overridden through the environment:
+
+    GUNICORN_BIND               address to listen on (default 0.0.0.0:$PORT)
+    GUNICORN_WORKER_CLASS       gthread (default), gevent or sync
+    GUNICORN_WORKERS            number of worker processes
+    GUNICORN_THREADS            threads per gthread worker (default 4)
+    GUNICORN_WORKER_CONNECTIONS concurrent requests per gevent worker (default 100)
+    GUNICORN_WORKER_MEMORY_MB   memory budgeted per worker (default 48)
+    GUNICORN_MAX_REQUESTS       requests before a worker is recycled (default 1000)
+    GUNICORN_PRELOAD            import the app once in the master (default true, false for gevent)
+    GUNICORN_TIMEOUT            seconds before a silent worker is killed (default 30)
+    GUNICORN_LOG_LEVEL          log level (default info)
+"""
+import math
+import os
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+# cgroup v1 reports "no limit" as a huge number rather than "max"
+UNLIMITED_MEMORY = 1 << 60
+
+
+def _read(path):
+    """Returns the stripped contents of a file, or None if it cannot be read"""
+    try:
+        with open(path, encoding="utf-8") as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+
+def cpu_limit(root=CGROUP_ROOT):
+    """Returns the cores the cgroup quota allows, or None if there is no quota"""
+    quota = _read(os.path.join(root, "cpu.max"))  # cgroup v2
+    if quota:
+        limit, _, period = quota.partition(" ")
+    else:  # cgroup v1
+        limit = _read(os.path.join(root, "cpu", "cpu.cfs_quota_us"))
+        period = _read(os.path.join(root, "cpu", "cpu.cfs_period_us"))
+    try:
+        limit, period = int(limit), int(period)
+    except (TypeError, ValueError):
+        return None  # "max" or no cgroup at all
+    if limit <= 0 or period <= 0:
+        return None
+    return limit / period
+
+
+def memory_limit(root=CGROUP_ROOT):
+    """Returns the bytes of memory the cgroup allows, or None if unlimited"""
+    for path in (
+        os.path.join(root, "memory.max"),  # cgroup v2
+        os.path.join(root, "memory", "memory.limit_in_bytes"),  # cgroup v1
+    ):
+        value = _read(path)
+        if value is None:
+            continue
+        try:
+            limit = int(value)
+        except ValueError:
+            return None  # "max"
+        return limit if limit < UNLIMITED_MEMORY else None
+    return None
+
+
+def available_cores(root=CGROUP_ROOT):
+    """Returns the whole cores this process may run on"""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:  # not on Linux
+        cores = os.cpu_count() or 1
+    quota = cpu_limit(root)
+    if quota is not None:
+        cores = min(cores, math.ceil(quota))
+    return max(cores, 1)
+
+
+def available_memory(root=CGROUP_ROOT):
+    """Returns the bytes of memory this process may use, or None if unknown"""
+    limit = memory_limit(root)
+    if limit is not None:
+        return limit
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def worker_count(cores, memory, worker_memory_mb):
+    """Returns 2 * cores + 1 workers, as many as the memory can hold"""
+    workers = 2 * cores + 1
+    if memory is not None:
+        workers = min(workers, memory // (worker_memory_mb * 1024 * 1024))
+    return max(int(workers), 1)
+
+
+def _env_flag(name, default):
+    return os.getenv(name, default).lower() in ("true", "1", "yes")
+
+
+######################################################################
+#  S E T T I N G S
+######################################################################
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:" + os.getenv("PORT", "8080"))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(
+    os.getenv("GUNICORN_WORKERS")
+    or worker_count(
+        available_cores(),
+        available_memory(),
+        int(os.getenv("GUNICORN_WORKER_MEMORY_MB", "48")),
+    )
+)
+# the service waits on Postgres far more than it computes, so each
+# worker overlaps several requests
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "100"))
+
+# import the app once in the master so workers start fast and share its
+# pages copy-on-write; post_fork below gives each worker its own pool
+# (gevent must patch the standard library before the app is imported,
+# so it does not preload unless asked to)
+preload_app = _env_flag("GUNICORN_PRELOAD", "false" if worker_class == "gevent" else "true")
+
+# recycle workers now and then so a slow leak cannot grow forever, with
+# jitter so they do not all restart at the same moment
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = max(max_requests // 10, 0)
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = timeout
+keepalive = 5
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+
+######################################################################
+#  S E R V E R   H O O K S
+######################################################################
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """Gives the new worker its own database connections"""
+    if worker_class == "gevent":
+        try:
+            from psycogreen.gevent import patch_psycopg  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            server.log.warning("psycogreen is not installed: database calls will block gevent workers")
+        else:
+            patch_psycopg()
+    if preload_app:
+        # the pool was created in the master; its sockets must not be
+        # shared across processes, so drop them without closing them
+        from service import app  # pylint: disable=import-outside-toplevel
+        from service.models import db  # pylint: disable=import-outside-toplevel
+        with app.app_context():
+            db.engine.dispose(close=False)
+
+
+def when_ready(server):
+    """Logs how the workers were sized"""
+    server.log.info(
+        "Serving with %s %s workers (%s threads, %s connections each)",
+        workers, worker_class, threads, worker_connections,
+    )
@@ -21,6 +21,7 @@ This module contains the microservice code for
     models
 """
 import sys
+import time
 from flask import Flask
 from flask_restx import Api
 from service.utils import log_handlers
@@ -30,6 +31,8 @@ from service import config
 # The Flask app must be created
 # BEFORE you import modules that depend on it !!!
 
+started = time.perf_counter()
+
 # Create the Flask app
 app = Flask(__name__)
 app.config.from_object(config)
@@ -46,7 +49,7 @@ api = Api(
     description="This is a sample server Shop Cart server.",
     default="shopcarts",
     default_label="Shop Cart shop operations",
-    doc="/apidocs",  # default also could use doc='/apidocs/'
+    doc="/apidocs" if app.config["API_DOCS"] else False,  # default also could use doc='/apidocs/'
     prefix="/api",
     format_checker=("str")
 )
@@ -54,6 +57,9 @@ api = Api(
 # Import the routes After the Flask app is created
 from service import routes  # noqa: E402, E261
 from .utils import error_handlers, cli_commands  # noqa: F401 E402
+from .utils.openapi import cache_spec  # noqa: E402
+
+cache_spec(app, api, app.config["OPENAPI_MAX_AGE"])
 
 
 # Set up logging for production
@@ -68,4 +74,11 @@ except Exception as error:
     app.logger.critical("%s: Cannot continue", error)
     # gunicorn requires exit code 4 to stop spawning workers when they die
     sys.exit(4)
-app.logger.info("Service initialized!")
+startup_seconds = time.perf_counter() - started
+app.logger.info("Service initialized in %.3f seconds!", startup_seconds)
+if startup_seconds > app.config["STARTUP_BUDGET_SECONDS"]:
+    app.logger.warning(
+        "Startup took %.3f seconds, over the budget of %s seconds",
+        startup_seconds,
+        app.config["STARTUP_BUDGET_SECONDS"],
+    )
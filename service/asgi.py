@@ -0,0 +1,292 @@
+"""
+ASGI entry point
+
+Serves the read paths of the Shop Cart API from an async SQLAlchemy
+engine so one process can keep many cart reads in flight while they
+wait on the database. Every other request, and every read the async
+path cannot answer itself (a missing cart, a bad cursor, an NDJSON
+export, a name search, a field mask), is handed to the Flask app
+through asgiref so the URLs, the payloads and the error bodies stay
+those of the Flask service.
+
+Run it with an ASGI server:
+    uvicorn service.asgi:application
+"""
+import re
+from urllib.parse import parse_qsl, quote
+from asgiref.wsgi import WsgiToAsgi
+from sqlalchemy import exists, select
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.datastructures import MIMEAccept, MultiDict
+from werkzeug.http import parse_accept_header, parse_etags
+from service import app, routes
+from service.models import DataValidationError, Product, Shopcart
+from service.utils import status
+from service.utils.pagination import next_page
+from service.utils.serializers import dumps
+
+ASYNC_DRIVERS = {"postgres": "postgresql+asyncpg", "postgresql": "postgresql+asyncpg"}
+
+SHOPCARTS = Shopcart.__table__
+PRODUCTS = Product.__table__
+PRODUCT_COLUMNS = [
+    PRODUCTS.c.id,
+    PRODUCTS.c.shopcart_id,
+    PRODUCTS.c.name,
+    PRODUCTS.c.price,
+    PRODUCTS.c.quantity,
+]
+
+
+def async_database_uri(uri: str) -> str:
+    """Returns the database uri with the scheme of its async driver"""
+    scheme, separator, rest = uri.partition("://")
+    return ASYNC_DRIVERS.get(scheme.split("+")[0], scheme) + separator + rest
+
+
+class AsyncRequest:
+    """The parts of an ASGI http scope the read paths look at"""
+
+    def __init__(self, scope):
+        self.headers = {
+            name.decode("latin-1").lower(): value.decode("latin-1")
+            for name, value in scope["headers"]
+        }
+        query = scope["query_string"].decode("latin-1")
+        self.args = MultiDict(parse_qsl(query, keep_blank_values=True))
+        host = self.headers.get("host")
+        if host is None:
+            server, port = scope.get("server") or ("localhost", 80)
+            host = "{}:{}".format(server, port)
+        self.base_url = "{}://{}{}".format(
+            scope.get("scheme", "http"),
+            host,
+            quote(scope.get("root_path", "") + scope["path"]),
+        )
+
+    @property
+    def accept_mimetypes(self):
+        """The parsed Accept header"""
+        return parse_accept_header(self.headers.get("accept"), MIMEAccept)
+
+    @property
+    def if_none_match(self):
+        """The parsed If-None-Match header"""
+        return parse_etags(self.headers.get("if-none-match"))
+
+
+class AsyncShopcartApp:
+    """
+    ASGI application for the Shop Cart service
+
+    Each read handler returns (status, headers, body), or None to let the
+    Flask app answer the request instead.
+    """
+
+    def __init__(self, wsgi_app, config):
+        self.config = config
+        self.fallback = WsgiToAsgi(wsgi_app)
+        self.routes = [
+            (re.compile(r"^/api/shopcarts/?$"), self.list_shopcarts),
+            (re.compile(r"^/api/shopcarts/(\d+)/?$"), self.get_shopcart),
+            (re.compile(r"^/api/shopcarts/(\d+)/products/?$"), self.list_products),
+            (re.compile(r"^/api/shopcarts/(\d+)/products/(\d+)/?$"), self.get_product),
+        ]
+        self._engine = None
+
+    @property
+    def engine(self):
+        """The async engine, created on first use inside the event loop"""
+        if self._engine is None:
+            self._engine = create_async_engine(
+                async_database_uri(self.config["SQLALCHEMY_DATABASE_URI"]),
+                pool_size=self.config["ASYNC_DB_POOL_SIZE"],
+                max_overflow=self.config["DB_MAX_OVERFLOW"],
+                pool_timeout=self.config["DB_POOL_TIMEOUT"],
+                pool_recycle=self.config["DB_POOL_RECYCLE"],
+                pool_pre_ping=self.config["DB_POOL_PRE_PING"],
+            )
+        return self._engine
+
+    async def dispose(self):
+        """Closes the connections of the async engine"""
+        if self._engine is not None:
+            await self._engine.dispose()
+            self._engine = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        response = None
+        if scope["type"] == "http" and scope["method"] == "GET":
+            response = await self.dispatch(scope)
+        if response is None:
+            await self.fallback(scope, receive, send)
+            return
+        code, headers, body = response
+        headers["Content-Length"] = str(len(body))
+        await send(
+            {
+                "type": "http.response.start",
+                "status": code,
+                "headers": [
+                    (name.encode("latin-1"), value.encode("latin-1"))
+                    for name, value in headers.items()
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+    async def lifespan(self, receive, send):
+        """Answers the ASGI lifespan protocol, closing the engine on shutdown"""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def dispatch(self, scope):
+        """Runs the read handler for the path, if there is one"""
+        for pattern, handler in self.routes:
+            match = pattern.match(scope["path"])
+            if match:
+                request = AsyncRequest(scope)
+                if self.config["RESTX_MASK_HEADER"].lower() in request.headers:
+                    return None
+                args = [int(group) for group in match.groups()]
+                try:
+                    return await handler(request, *args)
+                except DataValidationError:
+                    # the Flask app renders the 400 for it
+                    return None
+        return None
+
+    ######################################################################
+    #  R E A D   H A N D L E R S
+    ######################################################################
+
+    async def get_shopcart(self, request, id):
+        """Returns the Shop Cart with the given id"""
+        entry = await self.find_shopcart_data(id, request.if_none_match)
+        if entry is None:
+            return None
+        version, data = entry
+        headers = routes.etag_header(version)
+        if request.if_none_match.contains_weak(str(version)):
+            return status.HTTP_304_NOT_MODIFIED, headers, b""
+        return json_response(data, routes.render_shopcart, headers)
+
+    async def list_products(self, request, id):
+        """Returns a page of the Products in the Shop Cart with the given id"""
+        limit, after = routes.page_args(request.args)
+        query = (
+            select(*PRODUCT_COLUMNS)
+            .where(PRODUCTS.c.shopcart_id == id)
+            .order_by(PRODUCTS.c.id)
+            .limit(limit + 1)
+        )
+        if after is not None:
+            query = query.where(PRODUCTS.c.id > after)
+        async with self.engine.connect() as conn:
+            products = [dict(row._mapping) for row in await conn.execute(query)]
+            if not products:
+                found = select(SHOPCARTS.c.id).where(SHOPCARTS.c.id == id)
+                if (await conn.execute(found)).scalar() is None:
+                    return None
+        results, headers = next_page(request, products, limit)
+        return json_response(results, routes.render_product, headers)
+
+    async def get_product(self, request, id, product_id):  # pylint: disable=unused-argument
+        """Returns the Product with the given id"""
+        query = select(*PRODUCT_COLUMNS, PRODUCTS.c.version).where(PRODUCTS.c.id == product_id)
+        async with self.engine.connect() as conn:
+            row = (await conn.execute(query)).first()
+        if row is None:
+            return None
+        product = dict(row._mapping)
+        headers = routes.etag_header(product.pop("version"))
+        return json_response(product, routes.render_product, headers)
+
+    async def list_shopcarts(self, request):
+        """Returns a page of the Shop Carts, optionally filtered by product name"""
+        best = request.accept_mimetypes.best_match(
+            [routes.CONTENT_TYPE_JSON, routes.CONTENT_TYPE_NDJSON]
+        )
+        if best == routes.CONTENT_TYPE_NDJSON or any(routes.search_args(request.args)):
+            return None
+        limit, after = routes.page_args(request.args)
+        query = select(SHOPCARTS.c.id).order_by(SHOPCARTS.c.id).limit(limit + 1)
+        if after is not None:
+            query = query.where(SHOPCARTS.c.id > after)
+        name = request.args.get("name")
+        if name:
+            query = query.where(
+                exists().where(
+                    PRODUCTS.c.shopcart_id == SHOPCARTS.c.id, PRODUCTS.c.name == name
+                )
+            )
+        async with self.engine.connect() as conn:
+            ids = (await conn.execute(query)).scalars().all()
+            products = await self.find_products(conn, ids)
+        results = [{"id": id, "products": products.get(id, [])} for id in ids]
+        results, headers = next_page(request, results, limit)
+        return json_response(results, routes.render_shopcart, headers)
+
+    ######################################################################
+    #  D A T A B A S E   A C C E S S
+    ######################################################################
+
+    async def find_shopcart_data(self, id, etags=None):
+        """
+        Returns the version and the serialized Shop Cart with the given id
+        through the cache the Flask write paths invalidate, or None if the
+        Shop Cart does not exist
+
+        When the version matches one of etags the products are not loaded
+        and None is returned in place of the Shop Cart, as
+        routes.find_shopcart_data() does.
+        """
+        key = routes.cache_key(id)
+        entry = routes.cart_cache.get(key)
+        if entry is None:
+            generation = routes.cart_cache.generation()
+            query = select(SHOPCARTS.c.version).where(SHOPCARTS.c.id == id)
+            async with self.engine.connect() as conn:
+                version = (await conn.execute(query)).scalar()
+                if version is None:
+                    return None
+                if etags is not None and etags.contains_weak(str(version)):
+                    return version, None
+                products = await self.find_products(conn, [id])
+            entry = (version, {"id": id, "products": products.get(id, [])})
+            routes.cart_cache.set(key, entry, generation)
+        return entry
+
+    @staticmethod
+    async def find_products(conn, shopcart_ids):
+        """Returns the serialized Products of the Shop Carts, by Shop Cart id"""
+        products = {}
+        if not shopcart_ids:
+            return products
+        query = (
+            select(*PRODUCT_COLUMNS)
+            .where(PRODUCTS.c.shopcart_id.in_(shopcart_ids))
+            .order_by(PRODUCTS.c.id)
+        )
+        for row in await conn.execute(query):
+            products.setdefault(row.shopcart_id, []).append(dict(row._mapping))
+        return products
+
+
+def json_response(data, serializer, headers):
+    """Renders a 200 response the way routes.json_response() does"""
+    data = serializer.many(data) if isinstance(data, list) else serializer(data)
+    headers["Content-Type"] = routes.CONTENT_TYPE_JSON
+    return status.HTTP_200_OK, headers, dumps(data)
+
+
+application = AsyncShopcartApp(app, app.config)
@@ -4,6 +4,7 @@ Global Configuration for Application
 import os
 import json
 import logging
+from service.utils.pool_metrics import InstrumentedQueuePool
 
 # Get configuration from environment
 DATABASE_URI = os.getenv(
@@ -19,7 +20,55 @@ if 'VCAP_SERVICES' in os.environ:
 # Configure SQLAlchemy
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
-SQLALCHEMY_POOL_SIZE = 2
+
+# How each worker prepares the database when it starts:
+#   create - create the missing tables (development and tests)
+#   verify - only check the connection, the schema comes from `flask init-db`
+DB_INIT_MODE = os.getenv("DB_INIT_MODE", "create")
+
+# Seconds a worker may take to start before a warning is logged
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "2"))
+
+# Configure the connection pool of each worker
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "2"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("true", "1", "yes")
+
+# Connections the async engine of the ASGI entry point keeps open
+ASYNC_DB_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", "10"))
+
+SQLALCHEMY_ENGINE_OPTIONS = {}
+if not DATABASE_URI.startswith("sqlite"):
+    # SQLite gets the pool Flask-SQLAlchemy picks for it
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+# Keyset pagination for the collection endpoints
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+# Rows fetched per round trip when streaming an NDJSON export
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "100"))
+
+# In-process read-through cache of serialized Shop Carts
+# Each worker holds its own copy, so CART_CACHE_TTL bounds how long a
+# worker can serve a cart that was changed through another worker
+CART_CACHE_SIZE = int(os.getenv("CART_CACHE_SIZE", "4096"))
+CART_CACHE_TTL = float(os.getenv("CART_CACHE_TTL", "5"))
+
+# Serve the Swagger UI at /apidocs (the spec at /api/swagger.json is always served)
+API_DOCS = os.getenv("API_DOCS", "true").lower() in ("true", "1", "yes")
+
+# Seconds clients may reuse the spec before revalidating it with its ETag
+OPENAPI_MAX_AGE = int(os.getenv("OPENAPI_MAX_AGE", "300"))
 
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "sup3r-s3cr3t")
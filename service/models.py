@@ -4,7 +4,15 @@ Models for ShopCart
 All of the models are stored in this module
 """
 import logging
+import math
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import case, event, func, literal_column, or_, select, text, update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.orm import make_transient_to_detached, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy.orm.exc import StaleDataError
 
 logger = logging.getLogger("flask.app")
 
@@ -18,6 +26,178 @@ class DataValidationError(Exception):
     pass
 
 
+class ConcurrencyError(Exception):
+    """Used when a record was changed by someone else since it was read"""
+
+    pass
+
+
+class NotFoundError(Exception):
+    """Used when a record refers to a record that does not exist"""
+
+    pass
+
+
+class ConflictError(Exception):
+    """Used when a record would take the id of another record"""
+
+    pass
+
+
+# the SQLSTATEs of the integrity errors that are the client's to fix
+UNIQUE_VIOLATION = "23505"
+FOREIGN_KEY_VIOLATION = "23503"
+
+
+def _violation(error):
+    """Returns the (SQLSTATE, constraint name) of an IntegrityError"""
+    orig = error.orig
+    diag = getattr(orig, "diag", None)
+    return getattr(orig, "pgcode", None), getattr(diag, "constraint_name", None)
+
+
+def _string(max_length=None):
+    """
+    Returns the converter of a string of at most max_length characters,
+    which accepts only strings, the way JSON Schema's string type does
+    """
+    def convert(value):
+        if not isinstance(value, str):
+            raise TypeError("expected a string, got " + type(value).__name__)
+        if max_length is not None and len(value) > max_length:
+            raise ValueError("must be at most {} characters long".format(max_length))
+        return value
+    return convert
+
+
+# the length of a product name column
+NAME_LENGTH = 260
+
+
+# the bounds of an Integer column
+MIN_INTEGER = -(2**31)
+MAX_INTEGER = 2**31 - 1
+
+
+def _integer(minimum=MIN_INTEGER, maximum=MAX_INTEGER):
+    """
+    Returns the converter of a whole number between minimum and maximum,
+    which takes 3, 3.0 and "3" but neither 3.9 nor true
+    """
+    def convert(value):
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise TypeError("expected an integer, got " + type(value).__name__)
+        if isinstance(value, float) and not value.is_integer():
+            raise ValueError("expected an integer, got {}".format(value))
+        value = int(value)
+        if not minimum <= value <= maximum:
+            raise ValueError("must be between {} and {}".format(minimum, maximum))
+        return value
+    return convert
+
+
+def _number(value):
+    """Accepts finite numbers and the strings of them, but not true or false"""
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise TypeError("expected a number, got " + type(value).__name__)
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError("expected a finite number, got {}".format(value))
+    return value
+
+
+def _list_of(schema):
+    """Returns the converter of a list of resources validated by schema"""
+    def convert(value):
+        if not isinstance(value, list):
+            raise TypeError("expected a list, got " + type(value).__name__)
+        return [schema.validate(item) for item in value]
+    return convert
+
+
+class Schema:
+    """
+    The fields of a resource compiled into a single pass validator that
+    turns a request body into a dictionary of typed values
+    """
+
+    def __init__(self, resource: str, fields: list):
+        """
+        Args:
+            resource (str): the name used in the error messages
+            fields (list): (name, convert, required, nullable) tuples where
+                convert turns a JSON value into the typed value
+        """
+        self.resource = resource
+        self.fields = fields
+
+    def validate(self, data) -> dict:
+        """
+        Returns the typed values of data
+        Raises DataValidationError naming the first field that is wrong
+        """
+        if not isinstance(data, dict):
+            raise DataValidationError(
+                "Invalid {}: body of request contained bad or no data".format(self.resource)
+            )
+        values = {}
+        for name, convert, required, nullable in self.fields:
+            value = data.get(name)
+            if value is None:
+                if required and name not in data:
+                    raise DataValidationError("Invalid {}: missing {}".format(self.resource, name))
+                if not nullable:
+                    raise DataValidationError(
+                        "Invalid {}: {} must not be null".format(self.resource, name)
+                    )
+            else:
+                try:
+                    value = convert(value)
+                except (TypeError, ValueError) as error:
+                    raise DataValidationError(
+                        "Invalid {}: body of request contained bad data - {}: {}".format(
+                            self.resource, name, error
+                        )
+                    ) from error
+            values[name] = value
+        return values
+
+
+# the drift of a total_price kept in floating point that is not worth repairing
+TOTAL_PRICE_TOLERANCE = 0.005
+
+
+def _line_totals(quantity, price, sign=1):
+    """Returns the (line_count, item_count, total_price) a Product adds to its Shopcart"""
+    return (sign, sign * quantity, sign * quantity * price)
+
+
+def _add_totals(deltas, key, totals):
+    """Adds totals to the deltas of a Shopcart or a product name"""
+    current = deltas.get(key, (0, 0, 0.0))
+    deltas[key] = tuple(a + b for a, b in zip(current, totals))
+
+
+def _merge_lines(rows):
+    """Returns the values of Products with those sharing a name and a price merged"""
+    lines = {}
+    for values in rows:
+        key = (values["name"], values["price"])
+        if key in lines:
+            lines[key] = dict(lines[key], quantity=lines[key]["quantity"] + values["quantity"])
+        else:
+            lines[key] = values
+    return list(lines.values())
+
+
+def _name_totals(products, sign=1):
+    """Returns the totals Products add to the ProductStats, by name"""
+    stats = {}
+    for product in products:
+        _add_totals(stats, product.name, _line_totals(product.quantity, product.price, sign))
+    return stats
+
+
 class PersistentBase:
     """Base class added persistent methods"""
 
@@ -30,13 +210,29 @@ class PersistentBase:
 
     @classmethod
     def init_db(cls, app):
-        """Initializes the database session"""
-        logger.info("Initializing database")
+        """
+        Initializes the database session
+
+        With DB_INIT_MODE "create" the missing tables are created. With
+        "verify" only the connection is checked and the schema is left to
+        the init-db command, so a new worker sends a single query.
+        """
+        mode = app.config.get("DB_INIT_MODE", "create")
+        logger.info("Initializing database (%s)", mode)
+        if mode not in ("create", "verify"):
+            raise ValueError("Invalid DB_INIT_MODE: " + mode)
         cls.app = app
         # This is where we initialize SQLAlchemy from the Flask app
+        # Each request runs in its own application context and the thread
+        # scoped session is removed when it is torn down, so no context is
+        # pushed here for good
         db.init_app(app)
-        app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
+        with app.app_context():
+            if mode == "create":
+                db.create_all()  # make our sqlalchemy tables
+            else:
+                with db.engine.connect() as connection:
+                    connection.execute(text("SELECT 1"))
 
     @classmethod
     def all(cls):
@@ -44,6 +240,22 @@ class PersistentBase:
         logger.info("Processing all records")
         return cls.query.all()
 
+    @classmethod
+    def paginate(cls, query, after=None, limit=None):
+        """
+        Restricts a query to one keyset page ordered by primary key
+        Args:
+            query: the query to restrict
+            after (int): only return records with an id greater than this
+            limit (int): the maximum number of records to return
+        """
+        if after is not None:
+            query = query.filter(cls.id > after)
+        query = query.order_by(cls.id)
+        if limit is not None:
+            query = query.limit(limit)
+        return query
+
 
 ######################################################################
 #  P R O D U C T   M O D E L
@@ -55,10 +267,47 @@ class Product(db.Model, PersistentBase):
 
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(260), nullable=False)
-    quantity = db.Column(db.Integer, nullable=False)
-    price = db.Column(db.Float, nullable=False)
-    shopcart_id = db.Column(db.Integer, db.ForeignKey("shopcart.id"), nullable=False)
+    # the totals of the Shopcarts and the ProductStats are moved by the
+    # difference between the stored and the new values, so keep the
+    # stored ones when they change
+    name = db.column_property(
+        db.Column(db.String(NAME_LENGTH), nullable=False, index=True), active_history=True
+    )
+    quantity = db.column_property(db.Column(db.Integer, nullable=False), active_history=True)
+    price = db.column_property(db.Column(db.Float, nullable=False), active_history=True)
+    shopcart_id = db.column_property(
+        db.Column(db.Integer, db.ForeignKey("shopcart.id", ondelete="CASCADE"), nullable=False),
+        active_history=True,
+    )
+    # checked and bumped by every ORM update of the Product
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
+    __mapper_args__ = {"version_id_col": version}
+    # a Shopcart holds one line per name and price, see add_lines()
+    __table_args__ = (
+        db.UniqueConstraint("shopcart_id", "name", "price", name="uq_product_line"),
+    )
+
+    # the largest quantity the column can hold
+    MAX_QUANTITY = MAX_INTEGER
+
+    # The fields of a Product in a request body
+    request_schema = Schema(
+        "Product",
+        [
+            ("id", _integer(), False, True),
+            ("shopcart_id", _integer(), True, True),
+            ("name", _string(NAME_LENGTH), True, False),
+            ("price", _number, True, False),
+            ("quantity", _integer(0, MAX_QUANTITY), True, False),
+        ],
+    )
+
+    # The body of a request that adds to the quantity of a Product
+    delta_schema = Schema(
+        "quantity change",
+        [("quantity_delta", _integer(-MAX_QUANTITY, MAX_QUANTITY), True, False)],
+    )
 
     @classmethod
     def find(cls, by_id):
@@ -73,12 +322,114 @@ class Product(db.Model, PersistentBase):
             self.shopcart_id,
         )
 
-    def delete(self):
-        """Removes a Shopcart from the data store"""
-        logger.info("Deleting %s", self.id)
-        deletedCnt = db.session.delete(self)
+    def update(self, versions=None):
+        """
+        Updates a Product to the database
+        Args:
+            versions (list): the versions the Product may be at, None for any
+        """
+        logger.info("Updating %s", self.id)
+        message = "Product {} has been changed".format(self.id)
+        if versions is not None and self.version not in versions:
+            db.session.rollback()
+            raise ConcurrencyError(message)
+        if self.shopcart_id is None:
+            db.session.rollback()
+            raise DataValidationError("Invalid Product: shopcart_id must not be null")
+        deltas, stats = self._total_deltas()
+        # lock the Shopcarts before the Product, the order every write takes
+        for shopcart_id in sorted(deltas):
+            if Shopcart.touch(shopcart_id, delta=deltas[shopcart_id]) is None:
+                db.session.rollback()
+                raise NotFoundError("Shop Cart with id '{}' was not found.".format(shopcart_id))
+        try:
+            db.session.flush()
+        except StaleDataError as error:
+            db.session.rollback()
+            raise ConcurrencyError(message) from error
+        except IntegrityError as error:
+            db.session.rollback()
+            if _violation(error) != (UNIQUE_VIOLATION, "uq_product_line"):
+                raise
+            raise DataValidationError(
+                "Invalid Product: Shop Cart already has a Product with this name and price"
+            ) from error
+        ProductStat.record(stats)
         db.session.commit()
-        return deletedCnt
+
+    def delete(self, versions=None):
+        """
+        Removes a Product from the data store, see remove()
+        Args:
+            versions (list): the versions the Product may be at, None for any
+        """
+        product_id, shopcart_id = self.id, self.shopcart_id
+        if self in db.session:
+            db.session.expunge(self)
+        return Product.remove(shopcart_id, product_id, versions)
+
+    @classmethod
+    def remove(cls, shopcart_id, product_id, versions=None):
+        """
+        Removes a Product from a Shopcart with one statement that returns
+        the values the totals are moved by, so nothing read before is trusted
+        Args:
+            shopcart_id (Integer): the id of the Shopcart holding the Product
+            product_id (Integer): the id of the Product
+            versions (list): the versions the Product may be at, None for any
+        Returns the removed values, or None if the Shopcart has no such Product
+        Raises ConcurrencyError if the Product is not at one of versions
+        """
+        logger.info("Deleting %s", product_id)
+        # lock the Shopcart before the Product, the order every write takes
+        if Shopcart.touch(shopcart_id) is None:
+            db.session.rollback()
+            return None
+        table = cls.__table__
+        product = (table.c.id == product_id) & (table.c.shopcart_id == shopcart_id)
+        statement = table.delete().where(product)
+        if versions is not None:
+            statement = statement.where(table.c.version.in_(versions))
+        statement = statement.returning(table.c.name, table.c.quantity, table.c.price)
+        row = db.session.execute(statement).mappings().first()
+        if row is None:
+            db.session.rollback()
+            if versions is not None and db.session.execute(
+                select(table.c.id).where(product)
+            ).first() is not None:
+                db.session.rollback()
+                raise ConcurrencyError("Product {} has been changed".format(product_id))
+            db.session.rollback()
+            return None
+        row = dict(row)
+        delta = _line_totals(row["quantity"], row["price"], -1)
+        Shopcart.add_totals(shopcart_id, delta)
+        ProductStat.record({row["name"]: delta})
+        db.session.commit()
+        return row
+
+    def _total_deltas(self):
+        """
+        Returns the changes to the totals of the Shopcarts this Product is
+        in or is leaving, by Shopcart id, and to the ProductStats of its
+        stored and new names, by name, from the pending changes
+        """
+        attrs = db.inspect(self).attrs
+        stored = []
+        for name in ("shopcart_id", "name", "quantity", "price"):
+            history = attrs[name].history
+            stored.append((history.deleted or history.unchanged or [None])[0])
+        shopcart_id, name, quantity, price = stored
+        deltas, stats = {}, {}
+        if shopcart_id is not None:
+            removed = _line_totals(quantity, price, -1)
+            _add_totals(deltas, shopcart_id, removed)
+            _add_totals(stats, name, removed)
+        if self.shopcart_id is not None:
+            added = _line_totals(self.quantity, self.price)
+            _add_totals(deltas, self.shopcart_id, added)
+            _add_totals(stats, self.name, added)
+        return deltas, stats
 
     def __str__(self):
         return "%s: %s, %s" % (
@@ -89,12 +440,183 @@ class Product(db.Model, PersistentBase):
 
     def create(self):
         """
-        Creates a Product to the database
+        Creates a Product to the database, or adds its quantity to the
+        Product of its Shopcart with the same name and price
+        Returns True if a new Product was inserted, False if it was merged
         """
         logger.info("Creating %s", self.id)
-        self.id = None  # id must be none to generate next primary key
-        db.session.add(self)
+        if self in db.session:
+            db.session.expunge(self)
+        shopcart = self.shopcart
+        if self.shopcart_id is None and shopcart is not None:
+            # the Product was made for a Shopcart object, which must be
+            # stored first and must not insert the Product itself
+            if self in shopcart.products:
+                shopcart.products.remove(self)
+            db.session.add(shopcart)
+            db.session.flush()
+            self.shopcart_id = shopcart.id
+        values = {
+            "shopcart_id": self.shopcart_id,
+            "name": self.name,
+            "price": self.price,
+            "quantity": self.quantity,
+        }
+        row, inserted = Product.add_lines(self.shopcart_id, [values])[0]
+        for key, value in row.items():
+            set_committed_value(self, key, value)
+        make_transient_to_detached(self)
+        # when the session already holds the merged line, that object stays
+        # the one the session tracks and is brought up to date instead
+        stored = db.session.identity_map.get(identity_key(Product, self.id))
+        if stored is None:
+            db.session.add(self)
+        else:
+            for key, value in row.items():
+                set_committed_value(stored, key, value)
+        db.session.commit()
+        return inserted
+
+    @classmethod
+    def add_lines(cls, shopcart_id, rows):
+        """
+        Inserts Products into a Shopcart with one statement, adding the
+        quantity of each one that has the name and the price of a stored
+        Product to that Product instead
+        Args:
+            shopcart_id (Integer): the id of the Shopcart
+            rows (list): the values of the Products, without ids
+        Returns (values, inserted) pairs for the stored Products
+        Raises NotFoundError if there is no such Shopcart
+        """
+        rows = _merge_lines(rows)
+        # lock the Shopcart first, the lines it gains are only known below
+        items = sum(values["quantity"] for values in rows)
+        total = sum(values["quantity"] * values["price"] for values in rows)
+        if Shopcart.touch(shopcart_id, delta=(0, items, total)) is None:
+            db.session.rollback()
+            raise NotFoundError("Shop Cart with id '{}' was not found.".format(shopcart_id))
+        table = cls.__table__
+        statement = _upsert(table).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.shopcart_id, table.c.name, table.c.price],
+            set_={
+                "quantity": table.c.quantity + statement.excluded.quantity,
+                "version": table.c.version + 1,
+            },
+        ).returning(
+            *table.columns,
+            # a row inserted by this transaction has not been updated by any
+            (literal_column("xmax") == 0).label("inserted"),
+        )
+        results = []
+        for row in db.session.execute(statement).mappings():
+            row = dict(row)
+            results.append((row, row.pop("inserted")))
+        inserted = {(row["name"], row["price"]) for row, new in results if new}
+        stats = {}
+        for values in rows:
+            lines, items, total = _line_totals(values["quantity"], values["price"])
+            if (values["name"], values["price"]) not in inserted:
+                lines = 0
+            _add_totals(stats, values["name"], (lines, items, total))
+        if inserted:
+            Shopcart.add_totals(shopcart_id, (len(inserted), 0, 0.0))
+        ProductStat.record(stats)
+        return results
+
+    @classmethod
+    def create_many(cls, shopcart_id, data_list):
+        """
+        Creates Products in a Shopcart with one multi-row insert and one commit,
+        merging the ones that share a name and a price with each other or
+        with a stored Product
+        Args:
+            shopcart_id (Integer): the id of the Shopcart to add the Products to
+            data_list (list): the dictionaries containing the Products
+        Returns the created Products
+        """
+        if not data_list:
+            raise DataValidationError("Invalid Product list: no products")
+        rows = []
+        for data in data_list:
+            values = cls.request_schema.validate(data)
+            values["shopcart_id"] = shopcart_id
+            del values["id"]
+            rows.append(values)
+        logger.info("Creating %s products in %s", len(rows), shopcart_id)
+        created = [cls(**row) for row, _ in cls.add_lines(shopcart_id, rows)]
         db.session.commit()
+        return created
+
+    @classmethod
+    def add_quantity(cls, shopcart_id, product_id, delta, versions=None):
+        """
+        Adds to the quantity of a Product with one statement that neither
+        reads the Product first nor lets its quantity leave 0..MAX_QUANTITY
+        Args:
+            shopcart_id (Integer): the id of the Shopcart holding the Product
+            product_id (Integer): the id of the Product
+            delta (Integer): the quantity to add, negative to take some away
+            versions (list): the versions the Product may be at, None for any
+        Returns the stored values of the Product, or None if the Shopcart has no such Product
+        Raises DataValidationError if the quantity would be out of bounds and
+        ConcurrencyError if the Product is not at one of versions
+        """
+        logger.info("Adding %s to the quantity of %s", delta, product_id)
+        if abs(delta) > cls.MAX_QUANTITY:
+            raise DataValidationError("Invalid quantity change: quantity_delta is too large")
+        # lock the Shopcart before the Product, the order every write takes
+        if Shopcart.touch(shopcart_id) is None:
+            db.session.rollback()
+            return None
+        table = cls.__table__
+        product = (table.c.id == product_id) & (table.c.shopcart_id == shopcart_id)
+        statement = update(table).where(
+            product, table.c.quantity >= -delta, table.c.quantity <= cls.MAX_QUANTITY - delta
+        )
+        if versions is not None:
+            statement = statement.where(table.c.version.in_(versions))
+        statement = statement.values(
+            quantity=table.c.quantity + delta, version=table.c.version + 1
+        ).returning(*table.columns)
+        row = db.session.execute(statement).mappings().first()
+        if row is None:
+            # find out why nothing changed, which only the failures pay for
+            db.session.rollback()
+            found = db.session.execute(
+                select(table.c.quantity, table.c.version).where(product)
+            ).first()
+            db.session.rollback()
+            if found is None:
+                return None
+            if versions is not None and found.version not in versions:
+                raise ConcurrencyError("Product {} has been changed".format(product_id))
+            raise DataValidationError(
+                "Invalid quantity change: the quantity {} cannot change by {}".format(
+                    found.quantity, delta
+                )
+            )
+        row = dict(row)
+        totals = (0, delta, delta * row["price"])
+        Shopcart.add_totals(shopcart_id, totals)
+        ProductStat.record({row["name"]: totals})
+        db.session.commit()
+        return row
+
+    @classmethod
+    def delete_all(cls, shopcart_id):
+        """
+        Removes all of the Products from a Shopcart with one statement
+        Returns the totals they took from the ProductStats, by name
+        """
+        table = cls.__table__
+        statement = (
+            table.delete()
+            .where(table.c.shopcart_id == shopcart_id)
+            .returning(table.c.name, table.c.quantity, table.c.price)
+        )
+        return _name_totals(db.session.execute(statement), -1)
 
     def serialize(self):
         """Serializes a Product into a dictionary"""
@@ -112,20 +634,26 @@ class Product(db.Model, PersistentBase):
         Args:
             data (dict): A dictionary containing the resource data
         """
-        try:
-            self.shopcart_id = data["shopcart_id"]
-            self.name = data["name"]
-            self.price = data["price"]
-            self.quantity = data["quantity"]
-        except KeyError as error:
-            raise DataValidationError("Invalid Product: missing " + error.args[0])
-        except TypeError as error:
-            raise DataValidationError(
-                "Invalid Product: body of request contained "
-                "bad or no data " + error.args[0]
-            )
+        values = self.request_schema.validate(data)
+        self.shopcart_id = values["shopcart_id"]
+        self.name = values["name"]
+        self.price = values["price"]
+        self.quantity = values["quantity"]
         return self
 
+    @classmethod
+    def find_by_shopcart(cls, shopcart_id, after=None, limit=None):
+        """
+        Returns one page of the Products in a Shopcart
+        Args:
+            shopcart_id (Integer): the id of the Shopcart
+            after (Integer): only return Products with an id greater than this
+            limit (Integer): the maximum number of Products to return
+        """
+        logger.info("Processing products query for shopcart %s ...", shopcart_id)
+        query = cls.query.filter(cls.shopcart_id == shopcart_id)
+        return cls.paginate(query, after, limit).all()
+
     @classmethod
     def filter_by_product_name(cls, product_name):
         """
@@ -136,9 +664,63 @@ class Product(db.Model, PersistentBase):
         return cls.query.filter(cls.name == product_name)
 
 
+# Indexes for the name searches, created with the product table on Postgres
+NAME_PREFIX_INDEX = (
+    "CREATE INDEX IF NOT EXISTS ix_product_name_prefix "
+    "ON product (lower(name) text_pattern_ops)"
+)
+NAME_TRIGRAM_INDEX = (
+    "CREATE INDEX IF NOT EXISTS ix_product_name_trgm "
+    "ON product USING gin (name gin_trgm_ops)"
+)
+
+
+@event.listens_for(Product.__table__, "after_create")
+def create_search_indexes(target, connection, **kw):  # pylint: disable=unused-argument
+    """
+    Indexes lower(name) for prefix searches and, when the pg_trgm extension
+    can be installed, name by trigrams for substring and fuzzy searches
+    """
+    if connection.dialect.name != "postgresql":
+        return
+    connection.execute(text(NAME_PREFIX_INDEX))
+    try:
+        with connection.begin_nested():
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            connection.execute(text(NAME_TRIGRAM_INDEX))
+    except DBAPIError as error:
+        logger.warning("No trigram index, substring searches will scan products: %s", error.orig)
+
+
+# whether each engine's database has pg_trgm
+_trigram_engines = {}
+
+
+def trigram_search() -> bool:
+    """Returns whether the database has pg_trgm, checked once per engine"""
+    engine = db.engine
+    if engine not in _trigram_engines:
+        found = False
+        if engine.dialect.name == "postgresql":
+            query = text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            found = db.session.execute(query).scalar() is not None
+        _trigram_engines[engine] = found
+    return _trigram_engines[engine]
+
+
+def _like_escape(value):
+    """Escapes the wildcards of LIKE in a search term"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
 ######################################################################
 #  S H O P C A R T   M O D E L
 ######################################################################
+# Hands out the versions of every Shopcart, so a Shopcart that is deleted
+# and created again never repeats a version (an ETag) of its last life
+VERSION_SEQUENCE = db.Sequence("shopcart_version_seq")
+
+
 class Shopcart(db.Model, PersistentBase):
     """
     Class that represents an Shopcart
@@ -148,7 +730,33 @@ class Shopcart(db.Model, PersistentBase):
 
     # Table Schema
     id = db.Column(db.Integer, primary_key=True, nullable=False)
-    products = db.relationship("Product", backref="shopcart", passive_deletes=True)
+    # taken from VERSION_SEQUENCE again by every change to the Shopcart or
+    # its products
+    version = db.Column(
+        db.BigInteger,
+        VERSION_SEQUENCE,
+        nullable=False,
+        server_default=VERSION_SEQUENCE.next_value(),
+    )
+    # the totals of the products, moved in the same statement as the version
+    # as wide as the sums of Integer quantities they hold
+    line_count = db.Column(db.BigInteger, nullable=False, default=0, server_default="0")
+    item_count = db.Column(db.BigInteger, nullable=False, default=0, server_default="0")
+    total_price = db.Column(
+        db.Float, nullable=False, default=0.0, server_default="0", index=True
+    )
+    products = db.relationship(
+        "Product", backref="shopcart", order_by="Product.id", passive_deletes=True
+    )
+
+    # The fields of a Shopcart in a request body, its Products included
+    request_schema = Schema(
+        "Shopcart",
+        [
+            ("id", _integer(), True, False),
+            ("products", _list_of(Product.request_schema), True, False),
+        ],
+    )
 
     def __repr__(self):
         return "<Shopcart %r id=[%s]>" % (self.id, self.id)
@@ -161,23 +769,41 @@ class Shopcart(db.Model, PersistentBase):
         db.session.commit()
 
     def delete(self):
-        """Removes a Shopcart from the data store"""
+        """Removes a Shopcart and all of its Products from the data store"""
         logger.info("Deleting %s", self.id)
-        if self.products:
-            logger.info("delete")
-            for product in self.products:
-                product.delete()
+        # lock the Shopcart before its Products, the order every write takes
+        Shopcart.touch(self.id)
+        ProductStat.record(Product.delete_all(self.id))
+        # the products are gone, so keep the ORM from touching them again
+        db.session.expire(self, ["products"])
         deletedCnt = db.session.delete(self)
         db.session.commit()
         return deletedCnt
 
+    def clear(self):
+        """Removes all of the Products from a Shopcart with one statement"""
+        logger.info("Clearing %s", self.id)
+        shopcart_id = self.id
+        # lock the Shopcart before its Products, the order every write takes
+        version = Shopcart.touch(shopcart_id, reset=True)
+        ProductStat.record(Product.delete_all(shopcart_id))
+        db.session.commit()
+        # the cart is known to be empty, so do not reload it after the commit
+        set_committed_value(self, "id", shopcart_id)
+        set_committed_value(self, "version", version)
+        for name in ("line_count", "item_count", "total_price"):
+            set_committed_value(self, name, 0)
+        set_committed_value(self, "products", [])
+
     def create(self, id):
         """
         Creates a Shopcart to the database
         """
         logger.info("Creating %s", id)
         self.id = id  # id must be none to generate next primary key
+        self._count_products()
         db.session.add(self)
+        ProductStat.record(_name_totals(self.products))
         db.session.commit()
 
     def serialize(self):
@@ -190,42 +816,345 @@ class Shopcart(db.Model, PersistentBase):
             shopcart["products"].append(product.serialize())
         return shopcart
 
-    def deserialize(self, data):
+    def deserialize(self, data, versions=None):
         """
         Deserializes a Shopcart from a dictionary
         Args:
             data (dict): A dictionary containing the resource data
+            versions (list): the versions a stored Shopcart may be at, None for any
         """
+        values = self.request_schema.validate(data)
+        shopcart_id = values["id"]
+        # the products were validated with the shopcart
+        incoming = [(product.pop("id"), Product(**product)) for product in values["products"]]
         try:
-            self.id = data["id"]
-            # handle inner list of products
-            product_list = data.get("products")
-            if product_list:
-                for product in self.products:
-                    product.delete()
-            for json_product in product_list:
-                product = Product()
-                product.deserialize(json_product)
-                product.shopcart_id = self.id
-                self.products.append(product)
+            if db.inspect(self).persistent:
+                self._bump_version(versions)
+            self.id = shopcart_id
+            stats = self._merge_products(incoming) if incoming else {}
+            if db.inspect(self).persistent:
+                # the row is locked by the version bump, so the products
+                # cannot change under the new totals
+                self._count_products()
+                ProductStat.record(stats)
             self.update()
-        except KeyError as error:
-            raise DataValidationError("Invalid Shopcart: missing " + error.args[0])
-        except TypeError as error:
-            raise DataValidationError(
-                "Invalid Shopcart: body of request contained "
-                "bad or no data - " + error.args[0]
-            )
+        except StaleDataError as error:
+            db.session.rollback()
+            raise ConcurrencyError("Shop Cart {} has been changed".format(shopcart_id)) from error
+        except IntegrityError as error:
+            db.session.rollback()
+            violation = _violation(error)
+            if violation == (UNIQUE_VIOLATION, "uq_product_line"):
+                # two stored Products traded names and prices
+                raise DataValidationError(
+                    "Invalid Shopcart: Products cannot swap their names and prices"
+                ) from error
+            if violation == (UNIQUE_VIOLATION, "shopcart_pkey"):
+                raise ConflictError("Shopcart {} already exists".format(shopcart_id)) from error
+            if violation == (FOREIGN_KEY_VIOLATION, "product_shopcart_id_fkey"):
+                raise DataValidationError(
+                    "Invalid Shopcart: the id of a Shop Cart holding Products cannot change"
+                ) from error
+            raise
         return self
 
+    def _bump_version(self, versions):
+        """Bumps the version of a stored Shopcart if it is one of versions"""
+        shopcart_id = self.id
+        if Shopcart.touch(shopcart_id, versions) is None:
+            db.session.rollback()
+            raise ConcurrencyError("Shop Cart {} has been changed".format(shopcart_id))
+
+    def _count_products(self):
+        """Sets the totals of the Shopcart from its products"""
+        self.line_count = len(self.products)
+        self.item_count = sum(product.quantity for product in self.products)
+        self.total_price = sum(product.quantity * product.price for product in self.products)
+
+    @staticmethod
+    def _merge_lines(incoming, stored):
+        """
+        Merges the incoming Products that share a name and a price into one,
+        which takes the id of the stored Product with that name and price
+        when none of them was sent with an id
+        Args:
+            incoming (list): (id, Product) pairs where id is the id the
+                Product was sent with, if any
+            stored (dict): the stored Products, by id
+        Returns the merged (id, Product) pairs
+        """
+        sent_ids = {product_id for product_id, _ in incoming}
+        unsent = {
+            (product.name, product.price): product.id
+            for product in stored.values()
+            if product.id not in sent_ids
+        }
+        lines = {}
+        for product_id, product in incoming:
+            key = (product.name, product.price)
+            line = lines.get(key)
+            if line is None:
+                lines[key] = [product_id, product]
+                continue
+            line[1].quantity += product.quantity
+            if line[0] is None:
+                line[0] = product_id
+        for key, line in lines.items():
+            if line[0] is None:
+                line[0] = unsent.get(key)
+        return [tuple(line) for line in lines.values()]
+
+    def _merge_products(self, incoming):
+        """
+        Makes the stored Products match the incoming ones by issuing only
+        the inserts, updates and deletes that are needed
+        Args:
+            incoming (list): (id, Product) pairs where id is the id the
+                Product was sent with, if any
+        Returns the changes to the ProductStats, by name
+        """
+        stored = {product.id: product for product in self.products}
+        incoming = self._merge_lines(incoming, stored)
+        sent_ids = {product_id for product_id, _ in incoming}
+        stats = {}
+        for product_id in set(stored) - sent_ids:
+            product = stored.pop(product_id)
+            self.products.remove(product)
+            db.session.delete(product)
+            _add_totals(stats, product.name, _line_totals(product.quantity, product.price, -1))
+        if db.inspect(self).persistent:
+            # the ORM inserts and updates before it deletes, so delete
+            # first to free the names and prices of the removed Products
+            db.session.flush()
+        for product_id, product in incoming:
+            current = stored.pop(product_id, None)
+            if current is None:
+                product.shopcart_id = self.id
+                self.products.append(product)
+                _add_totals(stats, product.name, _line_totals(product.quantity, product.price))
+                continue
+            changed = [
+                field for field in ("name", "price", "quantity")
+                if getattr(current, field) != getattr(product, field)
+            ]
+            if changed:
+                _add_totals(stats, current.name, _line_totals(current.quantity, current.price, -1))
+                for field in changed:
+                    setattr(current, field, getattr(product, field))
+                _add_totals(stats, current.name, _line_totals(current.quantity, current.price))
+        return stats
+
     @classmethod
-    def filter_by_product_name(cls, product_name):
+    def filter_by_product_name(cls, product_name, after=None, limit=None):
         """Returns Shopcarts which has the give product_name"""
         logger.info("Product name is: %s", product_name)
-        selected_products = Product.filter_by_product_name(product_name)
-        return [
-            Shopcart.find_by_id(product.shopcart_id) for product in selected_products
-        ]
+        query = cls.with_products().filter(
+            cls.products.any(Product.name == product_name)
+        )
+        return cls.paginate(query, after, limit).all()
+
+    @classmethod
+    def search(cls, name_prefix=None, q=None, limit=10):
+        """
+        Returns the Shopcarts holding a product whose name starts with
+        name_prefix, or contains q, ignoring case, best match first
+
+        A cart ranks by its best product: an exact name, then a name
+        starting with the term, then by trigram similarity to the term
+        (or shorter names without pg_trgm). With pg_trgm, q also matches
+        names that only resemble it, to forgive typos.
+        Args:
+            name_prefix (string): the start of a product name
+            q (string): a part of a product name, used when there is no name_prefix
+            limit (Integer): the maximum number of Shopcarts to return
+        """
+        term = (name_prefix or q).lower()
+        logger.info("Searching products for %r ...", term)
+        pattern = _like_escape(term)
+        name = func.lower(Product.name)
+        starts = name.like(pattern + "%", escape="\\")
+        trigram = trigram_search()
+        if name_prefix:
+            match = starts
+        else:
+            match = Product.name.ilike("%" + pattern + "%", escape="\\")
+            if trigram:
+                match = or_(match, Product.name.op("%>")(term))
+        tier = case((name == term, 2), (starts, 1), else_=0)
+        if trigram:
+            score = func.word_similarity(term, Product.name)
+        else:
+            score = -func.length(Product.name)
+        ranked = (
+            select(Product.shopcart_id)
+            .where(match)
+            .group_by(Product.shopcart_id)
+            .order_by(func.max(tier).desc(), func.max(score).desc(), Product.shopcart_id)
+            .limit(limit)
+        )
+        ids = db.session.execute(ranked).scalars().all()
+        if not ids:
+            return []
+        shopcarts = {shopcart.id: shopcart for shopcart in cls.with_products().filter(cls.id.in_(ids))}
+        return [shopcarts[id] for id in ids if id in shopcarts]
+
+    @classmethod
+    def all(cls, after=None, limit=None):
+        """Returns all of the Shopcarts with their products
+        Args:
+            after (Integer): only return Shopcarts with an id greater than this
+            limit (Integer): the maximum number of Shopcarts to return
+        """
+        logger.info("Processing all records")
+        return cls.paginate(cls.with_products(), after, limit).all()
+
+    @classmethod
+    def touch(cls, shopcart_id, versions=None, delta=None, reset=False):
+        """
+        Gives a Shopcart a new version in the current transaction and moves
+        its totals in the same statement
+
+        Every write touches the Shopcarts it changes before it writes their
+        Products and then the ProductStats, so concurrent writers lock the
+        rows in the same order and wait for each other instead of deadlocking.
+        Args:
+            shopcart_id (Integer): the id of the Shopcart
+            versions (list): the versions the Shopcart may be at, None for any
+            delta (tuple): the (line_count, item_count, total_price) to add
+            reset (bool): start the totals from zero, for an emptied Shopcart
+        Returns the new version or None if there is no such Shopcart at
+        one of the versions
+        """
+        # the table's columns, so executing it does not autoflush the
+        # session before the Shopcart is locked
+        table = cls.__table__
+        statement = update(table).where(table.c.id == shopcart_id)
+        if versions is not None:
+            statement = statement.where(table.c.version.in_(versions))
+        values = {"version": VERSION_SEQUENCE.next_value()}
+        if reset:
+            values.update(line_count=0, item_count=0, total_price=0.0)
+        if delta is not None:
+            for name, change in zip(("line_count", "item_count", "total_price"), delta):
+                values[name] = values.get(name, table.c[name]) + change
+        statement = statement.values(**values).returning(table.c.version)
+        return db.session.execute(statement).scalar()
+
+    @classmethod
+    def add_totals(cls, shopcart_id, delta):
+        """
+        Moves the totals of a Shopcart already touched in the current
+        transaction, keeping its version
+        Args:
+            shopcart_id (Integer): the id of the Shopcart
+            delta (tuple): the (line_count, item_count, total_price) to add
+        """
+        table = cls.__table__
+        values = {
+            name: table.c[name] + change
+            for name, change in zip(("line_count", "item_count", "total_price"), delta)
+        }
+        db.session.execute(update(table).where(table.c.id == shopcart_id).values(**values))
+
+    @classmethod
+    def stream(cls, product_name=None, after=None, batch_size=100):
+        """
+        Returns an iterator over the Shopcarts and their products that is
+        fed from a server-side cursor batch_size rows at a time
+        Args:
+            product_name (string): only return Shopcarts holding this product
+            after (Integer): only return Shopcarts with an id greater than this
+            batch_size (Integer): the number of Shopcarts fetched per round trip
+        """
+        logger.info("Streaming records after %s", after)
+        query = cls.with_products()
+        if product_name:
+            query = query.filter(cls.products.any(Product.name == product_name))
+        query = cls.paginate(query, after)
+        return query.execution_options(stream_results=True).yield_per(batch_size)
+
+    @classmethod
+    def with_products(cls):
+        """Returns a Shopcart query that loads the products of every match
+        in a single additional query instead of one query per Shopcart
+        """
+        return cls.query.options(selectinload(cls.products))
+
+    @classmethod
+    def summaries(cls, ids):
+        """
+        Returns the totals of the Shopcarts with the given ids, read from
+        the columns the writes keep up to date without loading any Product
+        Args:
+            ids (list): the ids of the Shopcarts, those that do not exist are skipped
+        Returns dictionaries with the id, version, line_count (number of
+        Products), item_count (sum of their quantities) and total_price
+        """
+        logger.info("Processing summary query for %s shopcarts ...", len(ids))
+        shopcart = cls.__table__
+        query = (
+            select(
+                shopcart.c.id,
+                shopcart.c.version,
+                shopcart.c.line_count,
+                shopcart.c.item_count,
+                shopcart.c.total_price,
+            )
+            .where(shopcart.c.id.in_(ids))
+            .order_by(shopcart.c.id)
+        )
+        return [dict(row) for row in db.session.execute(query).mappings()]
+
+    @classmethod
+    def recompute_totals(cls, batch_size=1000):
+        """
+        Recomputes the totals of every Shopcart from its products, committing
+        every batch_size Shopcarts so no lock is held for long
+        Args:
+            batch_size (Integer): the number of Shopcarts updated per statement
+        Returns the number of Shopcarts whose totals were wrong
+        """
+        logger.info("Recomputing the totals of all shopcarts")
+        shopcart, product = cls.__table__, Product.__table__
+        owned = product.c.shopcart_id == shopcart.c.id
+        line_count = select(func.count(product.c.id)).where(owned).scalar_subquery()
+        item_count = (
+            select(func.coalesce(func.sum(product.c.quantity), 0, type_=db.BigInteger))
+            .where(owned)
+            .scalar_subquery()
+        )
+        total_price = (
+            select(func.coalesce(func.sum(product.c.price * product.c.quantity), 0.0))
+            .where(owned)
+            .scalar_subquery()
+        )
+        repaired = 0
+        after = None
+        while True:
+            query = select(shopcart.c.id).order_by(shopcart.c.id).limit(batch_size)
+            if after is not None:
+                query = query.where(shopcart.c.id > after)
+            ids = db.session.execute(query).scalars().all()
+            if not ids:
+                return repaired
+            statement = (
+                update(shopcart)
+                .where(shopcart.c.id.in_(ids))
+                .where(
+                    (shopcart.c.line_count != line_count)
+                    | (shopcart.c.item_count != item_count)
+                    | (func.abs(shopcart.c.total_price - total_price) > TOTAL_PRICE_TOLERANCE)
+                )
+                .values(
+                    version=VERSION_SEQUENCE.next_value(),
+                    line_count=line_count,
+                    item_count=item_count,
+                    total_price=total_price,
+                )
+            )
+            repaired += db.session.execute(statement).rowcount
+            db.session.commit()
+            after = ids[-1]
 
     @classmethod
     def find_by_id(cls, id):
@@ -235,3 +1164,121 @@ class Shopcart(db.Model, PersistentBase):
         """
         logger.info("Processing id query for %s ...", id)
         return cls.query.filter(cls.id == id).first()
+
+
+######################################################################
+#  P R O D U C T   S T A T   M O D E L
+######################################################################
+class ProductStat(db.Model):
+    """
+    Class that represents the totals of a product name across all of the
+    Shopcarts, moved by every Product write so they never need a scan
+
+    Each write upserts the row of every name it touches inside its own
+    transaction, so writes to different Shopcarts holding the same popular
+    name wait for each other's commit on that row. That is the price of
+    totals that are never stale.
+    """
+
+    # Table Schema
+    name = db.Column(db.String(NAME_LENGTH), primary_key=True)
+    # the cart lines holding the product, so a cart holding it at two
+    # prices counts twice; the counts of every cart add up past an Integer
+    line_count = db.Column(db.BigInteger, nullable=False, default=0, index=True)
+    total_quantity = db.Column(db.BigInteger, nullable=False, default=0, index=True)
+    total_value = db.Column(db.Float, nullable=False, default=0.0, index=True)
+
+    # the columns the top products may be ordered by
+    ORDERS = ("line_count", "total_quantity", "total_value")
+
+    def __repr__(self):
+        return "<ProductStat %r lines=[%s]>" % (self.name, self.line_count)
+
+    def serialize(self):
+        """Serializes a ProductStat into a dictionary"""
+        return {
+            "name": self.name,
+            "line_count": self.line_count,
+            "total_quantity": self.total_quantity,
+            "total_value": self.total_value,
+        }
+
+    @classmethod
+    def record(cls, deltas):
+        """
+        Adds changes to the ProductStats in the current transaction with one
+        upsert, creating the ones that do not exist yet
+        Args:
+            deltas (dict): the (line_count, total_quantity, total_value) to
+                add, by product name
+        """
+        rows = [
+            {"name": name, "line_count": lines, "total_quantity": items, "total_value": value}
+            # sorted, so concurrent writers lock the rows in the same order
+            for name, (lines, items, value) in sorted(deltas.items())
+            if lines or items or value
+        ]
+        if not rows:
+            return
+        table = cls.__table__
+        statement = _upsert(table).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.name],
+            set_={
+                name: table.c[name] + statement.excluded[name]
+                for name in ("line_count", "total_quantity", "total_value")
+            },
+        )
+        db.session.execute(statement)
+
+    @classmethod
+    def top(cls, order="line_count", limit=10):
+        """
+        Returns the products held by the most cart lines, or ordered by
+        another of the ORDERS, from the largest
+        Args:
+            order (string): one of the ORDERS
+            limit (Integer): the maximum number of products to return
+        """
+        if order not in cls.ORDERS:
+            raise DataValidationError("Invalid order: must be one of " + ", ".join(cls.ORDERS))
+        logger.info("Processing top %s products by %s ...", limit, order)
+        column = getattr(cls, order)
+        return (
+            cls.query.filter(cls.line_count > 0)
+            .order_by(column.desc(), cls.name)
+            .limit(limit)
+            .all()
+        )
+
+    @classmethod
+    def recompute(cls):
+        """
+        Rebuilds every ProductStat from the Products in one transaction
+        Returns the number of product names
+        """
+        logger.info("Recomputing the product stats")
+        table, product = cls.__table__, Product.__table__
+        if db.engine.dialect.name == "postgresql":
+            # writers record their changes after making them, so once the
+            # running ones have committed the scan below sees all of them,
+            # and the ones that start later wait and add theirs on top
+            db.session.execute(text("LOCK TABLE product_stat IN EXCLUSIVE MODE"))
+        db.session.execute(table.delete())
+        totals = select(
+            product.c.name,
+            func.count(product.c.id),
+            func.sum(product.c.quantity),
+            func.sum(product.c.price * product.c.quantity),
+        ).group_by(product.c.name)
+        statement = table.insert().from_select(
+            ["name", "line_count", "total_quantity", "total_value"], totals
+        )
+        count = db.session.execute(statement).rowcount
+        db.session.commit()
+        return count
+
+
+def _upsert(table):
+    """Returns an insert into table that can take an ON CONFLICT clause"""
+    return postgresql.insert(table)
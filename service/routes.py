@@ -12,10 +12,15 @@ DELETE /shopcarts/{id} - deletes a Shopcart record in the database
 """
 
 import logging
-from flask import request, abort
-from flask_restx import Resource, fields
-from service.models import Product, Shopcart
+from flask import Response, request, abort, stream_with_context
+from flask_restx import Resource, fields, marshal
+from werkzeug.http import quote_etag
+from service.models import NAME_LENGTH, DataValidationError, Product, ProductStat, Shopcart, db
 from service.utils import status  # HTTP Status Codes
+from service.utils.cache import LRUCache
+from service.utils.pagination import decode_cursor, next_page, parse_limit
+from service.utils.pool_metrics import pool_status
+from service.utils.serializers import BigInteger, Serializer, dumps
 from . import app, api
 
 ######################################################################
@@ -51,9 +56,9 @@ product_model = api.model(
         "id": fields.Integer(
             readOnly=True, description="The unique id assigned internally by service"
         ),
-        "name": fields.String(required=True, description="The name of the Product", maxLength=260),
+        "name": fields.String(required=True, description="The name of the Product", maxLength=NAME_LENGTH),
         "quantity": fields.Integer(
-            required=True, description="The quantity of the Product"
+            required=True, description="The quantity of the Product", min=0, max=Product.MAX_QUANTITY
         ),
         "price": fields.Float(required=True, description="The price of the Product"),
         "shopcart_id": fields.Integer(
@@ -72,6 +77,21 @@ shopcart_model = api.model(
         ),
     },
 )
+summary_model = api.model(
+    "ShopcartSummary",
+    {
+        "id": fields.Integer(readOnly=True, description="The id of the customer"),
+        "line_count": BigInteger(
+            readOnly=True, description="The number of products in the shop cart"
+        ),
+        "item_count": BigInteger(
+            readOnly=True, description="The total quantity of the products"
+        ),
+        "total_price": fields.Float(
+            readOnly=True, description="The sum of price times quantity of the products"
+        ),
+    },
+)
 
 product_parser = api.parser()
 product_parser.add_argument('id', type=int)
@@ -80,10 +100,57 @@ product_parser.add_argument('quantity', type=int)
 product_parser.add_argument('price', type=float)
 product_parser.add_argument('shopcart_id', type=int)
 
+quantity_delta_model = api.model(
+    "QuantityDelta",
+    {
+        "quantity_delta": fields.Integer(
+            required=True, description="The quantity to add to the product, negative to remove some"
+        ),
+    },
+)
+
+stat_model = api.model(
+    "ProductStat",
+    {
+        "name": fields.String(readOnly=True, description="The name of the product"),
+        "line_count": BigInteger(
+            readOnly=True, description="The number of shop cart lines holding the product"
+        ),
+        "total_quantity": BigInteger(
+            readOnly=True, description="The total quantity of the product in all shop carts"
+        ),
+        "total_value": fields.Float(
+            readOnly=True, description="The sum of price times quantity of the product"
+        ),
+    },
+)
+
+# Single pass serializers for the read paths, see json_response()
+render_product = Serializer(product_model)
+render_shopcart = Serializer(shopcart_model)
+render_summary = Serializer(summary_model)
+render_stat = Serializer(stat_model)
+
 shopcart_parser = api.parser()
 shopcart_parser.add_argument('id', type=int)
 shopcart_parser.add_argument('products', type=list)
 
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_NDJSON = "application/x-ndjson"
+
+PAGE_PARAMS = {
+    "limit": "The maximum number of results to return",
+    "after": "The cursor from the Link header of the previous page",
+}
+
+SEARCH_PARAMS = {
+    "name_prefix": "Search for carts holding a product whose name starts with this, ignoring case",
+    "q": "Search for carts holding a product whose name contains this, ignoring case",
+}
+
+# Serialized Shop Carts by id, invalidated by every write path below
+cart_cache = LRUCache(app.config["CART_CACHE_SIZE"], app.config["CART_CACHE_TTL"])
+
 ######################################################################
 #  PATH: /shopcarts/{id}
 ######################################################################
@@ -105,21 +172,22 @@ class ShopCartResource(Resource):
     # RETRIEVE A Shop Cart
     # ------------------------------------------------------------------
     @api.doc("get_shopcarts")
+    @api.response(200, "Success", shopcart_model)
+    @api.response(304, "Shop Cart not modified")
     @api.response(404, "Shop Cart not found")
-    @api.marshal_with(shopcart_model)
+    @api.header("ETag", "The version of the Shop Cart")
     def get(self, id):
         """
         Retrieve a single Shop Cart
         This endpoint will return a Shop Cart based on it's id
         """
         app.logger.info("Request to Retrieve a shop cart with id [%s]", id)
-        shopcart = Shopcart.find_by_id(id)
-        if not shopcart:
-            abort(
-                status.HTTP_404_NOT_FOUND,
-                "Shop Cart with id '{}' was not found.".format(id),
+        version, data = find_shopcart_data(id, request.if_none_match)
+        if request.if_none_match.contains_weak(str(version)):
+            return Response(
+                status=status.HTTP_304_NOT_MODIFIED, headers=etag_header(version)
             )
-        return shopcart.serialize(), status.HTTP_200_OK
+        return json_response(data, render_shopcart, headers=etag_header(version))
 
     # ------------------------------------------------------------------
     # UPDATE AN EXISTING Shop Cart
@@ -127,6 +195,8 @@ class ShopCartResource(Resource):
     @api.doc("update_shopcarts")
     @api.response(404, "Shop Cart not found")
     @api.response(400, "The posted Shop Cart data was not valid")
+    @api.response(409, "Another Shop Cart has the posted id")
+    @api.response(412, "The Shop Cart was changed since the If-Match version")
     @api.expect(shopcart_parser, validate=True)
     @api.marshal_with(shopcart_model)
     def put(self, id):
@@ -134,7 +204,6 @@ class ShopCartResource(Resource):
         Update a Shop Cart
         This endpoint will update a Shop Cart based the body that is posted
         """
-        shopcart_parser.parse_args()
         app.logger.info("Request to Update a Shop Cart with id [%s]", id)
         shopcart = Shopcart.find_by_id(id)
         if not shopcart:
@@ -144,10 +213,11 @@ class ShopCartResource(Resource):
             )
         app.logger.debug("Payload = %s", api.payload)
         data = api.payload
-        shopcart.deserialize(data)
+        shopcart.deserialize(data, if_match_versions())
         shopcart.id = id
         shopcart.update()
-        return shopcart.serialize(), status.HTTP_200_OK
+        invalidate_shopcarts(id, data["id"])
+        return shopcart.serialize(), status.HTTP_200_OK, etag_header(shopcart.version)
 
     # ------------------------------------------------------------------
     # DELETE A Shop Cart
@@ -163,6 +233,7 @@ class ShopCartResource(Resource):
         shopcart = Shopcart.find_by_id(id)
         if shopcart:
             shopcart.delete()
+            invalidate_shopcarts(id)
             app.logger.info("Shop Cart with id [%s] was deleted", id)
         return "", status.HTTP_204_NO_CONTENT
 
@@ -179,7 +250,6 @@ class ShopCartResource(Resource):
         Creates a Shop Cart
         This endpoint will create a Shop Cart based the data in the body that is posted
         """
-        shopcart_parser.parse_args()
         app.logger.info("Request to Create a Shop Cart")
         shopcart = Shopcart()
         app.logger.debug("Payload = %s", api.payload)
@@ -192,7 +262,8 @@ class ShopCartResource(Resource):
         shopcart.create(id)
         app.logger.info("shopcart with new id [%s] created!", id)
         location_url = api.url_for(ShopCartResource, id=shopcart.id, _external=True)
-        return shopcart.serialize(), status.HTTP_201_CREATED, {"Location": location_url}
+        headers = {"Location": location_url, **etag_header(shopcart.version)}
+        return shopcart.serialize(), status.HTTP_201_CREATED, headers
 
 
 ######################################################################
@@ -295,8 +366,8 @@ class ProductResource(Resource):
     # RETRIEVE A Product
     # ------------------------------------------------------------------
     @api.doc("get_products")
+    @api.response(200, "Success", product_model)
     @api.response(404, "Product not found")
-    @api.marshal_with(product_model)
     def get(self, id, product_id):
         """
         Retrieve a single Product
@@ -313,13 +384,14 @@ class ProductResource(Resource):
                 status.HTTP_404_NOT_FOUND,
                 "Product with id '{}' was not found.".format(product_id),
             )
-        return product.serialize(), status.HTTP_200_OK
+        return json_response(product, render_product, headers=etag_header(product.version))
 
     # ------------------------------------------------------------------
     # DELETE A Product
     # ------------------------------------------------------------------
     @api.doc("delete_products")
     @api.response(204, "Product deleted")
+    @api.response(412, "The Product was changed since the If-Match version")
     def delete(self, id, product_id):
         """
         Delete a Product
@@ -330,18 +402,19 @@ class ProductResource(Resource):
             product_id,
             id,
         )
-        product = Product.find(product_id)
-        if product:
-            product.delete()
-            app.logger.info("Product with id [%s] was deleted", product_id)
+        if id.isdigit() and product_id.isdigit():
+            if Product.remove(int(id), int(product_id), if_match_versions()) is not None:
+                invalidate_shopcarts(id)
+                app.logger.info("Product with id [%s] was deleted", product_id)
         return "", status.HTTP_204_NO_CONTENT
 
     # ------------------------------------------------------------------
     # UPDATE AN EXISTING Product
     # ------------------------------------------------------------------
     @api.doc("update_products")
-    @api.response(404, "Product not found")
+    @api.response(404, "Product or the Shop Cart it is moved to not found")
     @api.response(400, "The posted Product data was not valid")
+    @api.response(412, "The Product was changed since the If-Match version")
     @api.expect(product_parser, validate=True)
     @api.marshal_with(product_model)
     def put(self, id, product_id):
@@ -349,7 +422,6 @@ class ProductResource(Resource):
         Update a Product
         This endpoint will update a Product based the body that is posted
         """
-        args = product_parser.parse_args()
         app.logger.info(
             "Request to Update a Product with id [%s] for customer with id [%s]",
             product_id,
@@ -363,10 +435,45 @@ class ProductResource(Resource):
             )
         app.logger.debug("Payload = %s", api.payload)
         # data = api.payload
-        product.deserialize(args)
+        shopcart_id = product.shopcart_id
+        product.deserialize(api.payload)
         product.id = product_id
-        product.update()
-        return product.serialize(), status.HTTP_200_OK
+        product.update(if_match_versions())
+        invalidate_shopcarts(id, shopcart_id, product.shopcart_id)
+        return product.serialize(), status.HTTP_200_OK, etag_header(product.version)
+
+    # ------------------------------------------------------------------
+    # CHANGE THE QUANTITY OF A Product
+    # ------------------------------------------------------------------
+    @api.doc("adjust_products")
+    @api.expect(quantity_delta_model)
+    @api.response(200, "Success", product_model)
+    @api.response(400, "The quantity_delta was not valid or would make the quantity negative")
+    @api.response(404, "Product not found")
+    @api.response(412, "The Product was changed since the If-Match version")
+    @api.header("ETag", "The version of the Product")
+    def patch(self, id, product_id):
+        """
+        Change the quantity of a Product
+        This endpoint adds quantity_delta to the quantity of a Product in one statement,
+        so concurrent changes never overwrite each other
+        """
+        app.logger.info(
+            "Request to Change the quantity of a Product with id [%s] for customer with id [%s]",
+            product_id,
+            id,
+        )
+        delta = Product.delta_schema.validate(api.payload)["quantity_delta"]
+        product = None
+        if id.isdigit() and product_id.isdigit():
+            product = Product.add_quantity(int(id), int(product_id), delta, if_match_versions())
+        if product is None:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                "Product with id '{}' was not found in Shop Cart '{}'.".format(product_id, id),
+            )
+        invalidate_shopcarts(id)
+        return json_response(product, render_product, headers=etag_header(product["version"]))
 
 
 ######################################################################
@@ -378,26 +485,28 @@ class ProductOperation(Resource):
     # ------------------------------------------------------------------
     # LIST ALL ProductS
     # ------------------------------------------------------------------
-    @api.doc("list_products")
+    @api.doc("list_products", params=PAGE_PARAMS)
+    @api.response(200, "Success", [product_model])
     @api.response(404, "Shop Cart not found")
-    @api.marshal_list_with(product_model)
     def get(self, id):
         """Returns the list of products in the shopcart"""
         app.logger.info("Request to list Products...")
-        shopcart = Shopcart().find_by_id(id)
-        if not shopcart:
+        limit, after = page_args()
+        products = Product.find_by_shopcart(id, after, limit + 1)
+        if not products and not Shopcart.find_by_id(id):
             abort(
                 status.HTTP_404_NOT_FOUND,
                 "Shop Cart with id '{}' was not found.".format(id),
             )
-        results = [product.serialize() for product in shopcart.products]
+        results, headers = next_page(request, products, limit)
         app.logger.info("[%s] Products returned", len(results))
-        return results, status.HTTP_200_OK
+        return json_response(results, render_product, headers=headers)
 
     # ------------------------------------------------------------------
     # Add A NEW Product to the shopcart
     # ------------------------------------------------------------------
     @api.doc("add_products")
+    @api.response(200, "The quantity was added to the Product with the same name and price", product_model)
     @api.response(400, "The posted data was not valid")
     @api.response(404, "Product not found")
     @api.expect(product_parser, validate=True)
@@ -405,9 +514,12 @@ class ProductOperation(Resource):
     def post(self, id):
         """
         Creates a Product
-        This endpoint will create a Product and add it to the shopcart based the data in the body that is posted
+        This endpoint will create a Product and add it to the shopcart based the data in the body that is posted.
+        When the shopcart already holds a Product with the same name and price, the quantity is added to it.
+        Posting a list of Products adds all of them in a single transaction.
         """
-        product_parser.parse_args()
+        if isinstance(api.payload, list):
+            return self.post_batch(id)
         app.logger.info("Request to Create a Product")
         shopcart = Shopcart().find_by_id(id)
         if not shopcart:
@@ -419,9 +531,24 @@ class ProductOperation(Resource):
         app.logger.debug("Payload = %s", api.payload)
         data = api.payload
         product.deserialize(data)
-        shopcart.products.append(product)
-        shopcart.update()
-        return product.serialize(), status.HTTP_201_CREATED
+        product.shopcart_id = shopcart.id
+        inserted = product.create()
+        invalidate_shopcarts(id)
+        return product.serialize(), status.HTTP_201_CREATED if inserted else status.HTTP_200_OK
+
+    def post_batch(self, id):
+        """Adds a list of Products to the shopcart with one insert and one commit"""
+        app.logger.info("Request to Create %s Products", len(api.payload))
+        shopcart = Shopcart().find_by_id(id)
+        if not shopcart:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                "Shop Cart with id '{}' was not found.".format(id),
+            )
+        products = Product.create_many(shopcart.id, api.payload)
+        invalidate_shopcarts(id)
+        app.logger.info("[%s] Products created", len(products))
+        return [product.serialize() for product in products], status.HTTP_201_CREATED
 
 
 '''
@@ -552,22 +679,37 @@ class ShopcartCollection(Resource):
     # ------------------------------------------------------------------
     # LIST ALL Shop carts
     # ------------------------------------------------------------------
-    @api.doc("list_shopcarts")
-    @api.marshal_list_with(shopcart_model)
+    @api.doc("list_shopcarts", params=dict(PAGE_PARAMS, **SEARCH_PARAMS))
+    @api.produces([CONTENT_TYPE_JSON, CONTENT_TYPE_NDJSON])
+    @api.response(200, "Success", [shopcart_model])
+    @api.response(400, "The search or the page was not valid")
     def get(self):
-        """Returns all of the Shopcarts"""
+        """Returns all of the Shopcarts
+
+        Send Accept: application/x-ndjson to stream every matching Shop Cart,
+        one JSON document per line, instead of a page of them. A search with
+        name_prefix or q returns up to limit Shop Carts, best match first,
+        in a single JSON list without a next page
+        """
         app.logger.info("Request for Shop Cart list")
         id = request.args.get("id")
         name = request.args.get("name")
-        results = []
+        limit, after = page_args()
+        name_prefix, q = search_args()
+        if name_prefix or q:
+            shopcarts = Shopcart.search(name_prefix, q, limit)
+            return json_response(shopcarts, render_shopcart)
+        if request.accept_mimetypes.best_match(
+            [CONTENT_TYPE_JSON, CONTENT_TYPE_NDJSON]
+        ) == CONTENT_TYPE_NDJSON:
+            return stream_shopcarts(name, after)
         if name:
             app.logger.info("Request to Retrieve a shop cart with id [%s]", id)
-            shopcarts = Shopcart.filter_by_product_name(name)
-            results = [shopcart.serialize() for shopcart in shopcarts]
+            shopcarts = Shopcart.filter_by_product_name(name, after, limit + 1)
         else:
-            shopcarts = Shopcart.all()
-            results = [shopcart.serialize() for shopcart in shopcarts]
-        return results, status.HTTP_200_OK
+            shopcarts = Shopcart.all(after, limit + 1)
+        shopcarts, headers = next_page(request, list(shopcarts), limit)
+        return json_response(shopcarts, render_shopcart, headers=headers)
 
 
 '''
@@ -585,6 +727,105 @@ def list_shopcarts():
         results = [shopcart.serialize() for shopcart in shopcarts]
     return make_response(jsonify(results), status.HTTP_200_OK)
 '''
+######################################################################
+#  PATH: /shopcarts/{id}/summary
+######################################################################
+
+
+@api.route("/shopcarts/<id>/summary")
+@api.param("id", "The shop cart identifier")
+class ShopcartSummaryResource(Resource):
+    # ------------------------------------------------------------------
+    # SUMMARIZE A Shop Cart
+    # ------------------------------------------------------------------
+    @api.doc("get_shopcart_summary")
+    @api.response(200, "Success", summary_model)
+    @api.response(304, "Shop Cart not modified")
+    @api.response(404, "Shop Cart not found")
+    @api.header("ETag", "The version of the Shop Cart")
+    def get(self, id):
+        """
+        Summarize a Shop Cart
+        This endpoint returns the number of products, their total quantity and
+        their total price without returning the products
+        """
+        app.logger.info("Request to Summarize a shop cart with id [%s]", id)
+        summaries = Shopcart.summaries([id]) if id.isdigit() else []
+        if not summaries:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                "Shop Cart with id '{}' was not found.".format(id),
+            )
+        summary = summaries[0]
+        headers = etag_header(summary["version"])
+        if request.if_none_match.contains_weak(str(summary["version"])):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return json_response(summary, render_summary, headers=headers)
+
+
+######################################################################
+#  PATH: /shopcarts/summary
+######################################################################
+
+
+@api.route("/shopcarts/summary")
+class ShopcartSummaryCollection(Resource):
+    # ------------------------------------------------------------------
+    # SUMMARIZE SEVERAL Shop Carts
+    # ------------------------------------------------------------------
+    @api.doc(
+        "list_shopcart_summaries",
+        params={"id": "The shop cart ids, repeated or comma separated"},
+    )
+    @api.response(200, "Success", [summary_model])
+    @api.response(400, "An id was not valid")
+    def get(self):
+        """
+        Summarize several Shop Carts
+        This endpoint returns the summaries of the Shop Carts with the given ids
+        in one query. Ids of Shop Carts that do not exist are skipped.
+        """
+        ids = summary_ids()
+        app.logger.info("Request to Summarize %s shop carts", len(ids))
+        summaries = Shopcart.summaries(ids) if ids else []
+        return json_response(summaries, render_summary)
+
+
+######################################################################
+#  PATH: /analytics/products
+######################################################################
+
+
+@api.route("/analytics/products")
+class ProductAnalyticsResource(Resource):
+    # ------------------------------------------------------------------
+    # LIST THE TOP products across all Shop Carts
+    # ------------------------------------------------------------------
+    @api.doc(
+        "list_top_products",
+        params={
+            "order": "line_count (default), total_quantity or total_value",
+            "limit": "The maximum number of products to return",
+        },
+    )
+    @api.response(200, "Success", [stat_model])
+    @api.response(400, "The order or the limit was not valid")
+    def get(self):
+        """
+        List the top products
+        This endpoint returns the products held by the most Shop Cart lines, or with the
+        largest total quantity or value, from counters every write keeps up to date
+        """
+        order = request.args.get("order", "line_count")
+        limit = parse_limit(
+            request.args.get("limit"),
+            app.config["DEFAULT_PAGE_SIZE"],
+            app.config["MAX_PAGE_SIZE"],
+        )
+        app.logger.info("Request for the top %s products by %s", limit, order)
+        return json_response(ProductStat.top(order, limit), render_stat)
+
+
 ######################################################################
 #  PATH: /shopcarts/{id}/clear
 ######################################################################
@@ -607,19 +848,15 @@ class ShopcartAction(Resource):
         This endpoint will update a Shop Cart based the body that is posted
         """
         app.logger.info("Request to Update a Shop Cart with id [%s]", id)
-        shopcart_parser.parse_args()
         shopcart = Shopcart.find_by_id(id)
         if not shopcart:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 "Shop Cart with id '{}' was not found.".format(id),
             )
-        for product in shopcart.products:
-            product.delete()
-        shopcart.products = []
-        shopcart.id = id
-        shopcart.update()
-        return shopcart.serialize(), status.HTTP_200_OK
+        shopcart.clear()
+        invalidate_shopcarts(id)
+        return shopcart.serialize(), status.HTTP_200_OK, etag_header(shopcart.version)
 
 
 '''
@@ -684,6 +921,25 @@ def filter_shopcarts_by_product_name(product_name):
     return make_response(jsonify(results), status.HTTP_200_OK)
 '''
 
+######################################################################
+#  PATH: /metrics/pool
+######################################################################
+
+
+@api.route("/metrics/pool")
+class PoolMetricsResource(Resource):
+    # ------------------------------------------------------------------
+    # REPORT the connection pool of this worker
+    # ------------------------------------------------------------------
+    @api.doc("get_pool_metrics")
+    def get(self):
+        """
+        Report the database connection pool
+        This endpoint returns the pool state and the checkout telemetry of the worker that serves it
+        """
+        return pool_status(db.engine.pool), status.HTTP_200_OK
+
+
 ######################################################################
 #  U T I L I T Y   F U N C T I O N S
 ######################################################################
@@ -701,6 +957,128 @@ def check_content_type(media_type):
     )
 
 
+def stream_shopcarts(name, after):
+    """Streams the Shopcarts as NDJSON while they are read from the database"""
+    shopcarts = Shopcart.stream(name, after, app.config["STREAM_BATCH_SIZE"])
+
+    def generate():
+        for shopcart in shopcarts:
+            yield dumps(render_shopcart(shopcart))
+
+    return Response(
+        stream_with_context(generate()),
+        status=status.HTTP_200_OK,
+        mimetype=CONTENT_TYPE_NDJSON,
+    )
+
+
+def json_response(data, serializer, code=status.HTTP_200_OK, headers=None):
+    """
+    Renders an object, a dictionary or a list of them as JSON with a
+    compiled serializer, or with marshal() when the client asked for a
+    subset of the fields with the mask header
+    """
+    mask = request.headers.get(app.config["RESTX_MASK_HEADER"])
+    if mask:
+        data = marshal(data, serializer.model, mask=mask)
+    elif isinstance(data, list):
+        data = serializer.many(data)
+    else:
+        data = serializer(data)
+    return Response(dumps(data), status=code, headers=headers, mimetype=CONTENT_TYPE_JSON)
+
+
+def cache_key(id):
+    """Returns the key a Shop Cart id from a URL or a payload is cached under"""
+    try:
+        return int(id)
+    except (TypeError, ValueError):
+        return id
+
+
+def find_shopcart_data(id, etags=None):
+    """
+    Returns the version and the serialized Shop Cart with the given id,
+    reading them through the cache, or aborts with 404 if it does not exist
+
+    When the version matches one of etags the Shop Cart is not serialized
+    and None is returned in its place. The returned dictionary is shared
+    with the cache and must not be changed.
+    """
+    entry = cart_cache.get(cache_key(id))
+    if entry is None:
+        generation = cart_cache.generation()
+        shopcart = Shopcart.find_by_id(id)
+        if not shopcart:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                "Shop Cart with id '{}' was not found.".format(id),
+            )
+        if etags is not None and etags.contains_weak(str(shopcart.version)):
+            return shopcart.version, None
+        entry = (shopcart.version, shopcart.serialize())
+        cart_cache.set(cache_key(id), entry, generation)
+    return entry
+
+
+def etag_header(version):
+    """Returns the ETag header for a version of a Shop Cart or a Product"""
+    return {"ETag": quote_etag(str(version))}
+
+
+def if_match_versions():
+    """Returns the versions allowed by the If-Match header, None for any"""
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    return [int(tag) for tag in request.if_match.as_set() if tag.isdigit()]
+
+
+def invalidate_shopcarts(*ids):
+    """Drops the cached copies of the Shop Carts with the given ids"""
+    cart_cache.invalidate(*(cache_key(id) for id in ids if id is not None))
+
+
+def search_args(args=None):
+    """Returns the name_prefix and the q of a Shop Cart search, None when absent"""
+    if args is None:
+        args = request.args
+    name_prefix, q = args.get("name_prefix"), args.get("q")
+    if name_prefix is not None and q is not None:
+        raise DataValidationError("Invalid search: use name_prefix or q, not both")
+    for name, value in (("name_prefix", name_prefix), ("q", q)):
+        if value is not None and not value.strip():
+            raise DataValidationError("Invalid search: {} must not be blank".format(name))
+    return name_prefix, q
+
+
+def page_args(args=None):
+    """Returns the page size and the decoded cursor of a collection request"""
+    if args is None:
+        args = request.args
+    limit = parse_limit(
+        args.get("limit"),
+        app.config["DEFAULT_PAGE_SIZE"],
+        app.config["MAX_PAGE_SIZE"],
+    )
+    return limit, decode_cursor(args.get("after"))
+
+
+def summary_ids():
+    """Returns the Shop Cart ids of a summary request"""
+    values = [
+        value
+        for arg in request.args.getlist("id")
+        for value in arg.split(",")
+        if value
+    ]
+    if len(values) > app.config["MAX_PAGE_SIZE"]:
+        raise DataValidationError("Too many ids: {}".format(len(values)))
+    for value in values:
+        if not value.isdigit():
+            raise DataValidationError("Invalid id: " + value)
+    return sorted({int(value) for value in values})
+
+
 def init_db():
     """Initialize the model"""
     Shopcart.init_db(app)
@@ -0,0 +1,98 @@
+"""
+Cache
+
+This module contains a small thread-safe LRU cache whose entries
+expire after a time to live. It is used to keep recently read Shop
+Carts in process memory between requests.
+
+A reader takes the generation() before it reads the database and hands
+it to set(), which drops the value if its key was invalidated since, so
+a read that raced a write cannot cache what the write replaced.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A size bounded least recently used cache with a time to live"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30.0, clock=time.monotonic):
+        """
+        Args:
+            maxsize (int): the most entries to hold, 0 disables the cache
+            ttl (float): the number of seconds an entry stays valid
+            clock: the function returning the current time in seconds
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # the generation of the last invalidation of each recent key, the
+        # older ones forgotten below _floor
+        self._generation = 0
+        self._invalidated = OrderedDict()
+        self._floor = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns the value cached under key or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= self.clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def generation(self):
+        """Returns the generation to hand to set() for a value read from now on"""
+        with self._lock:
+            return self._generation
+
+    def set(self, key, value, generation=None):
+        """
+        Caches value under key, evicting the least recently used entry
+        Args:
+            key: the key to cache value under
+            value: the value to cache
+            generation (int): the generation() taken before value was read,
+                so the value is dropped if key was invalidated since
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if generation is not None and (
+                generation < self._floor or self._invalidated.get(key, -1) > generation
+            ):
+                return
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *keys):
+        """Removes the entries cached under keys"""
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+                self._invalidated[key] = self._generation
+                self._invalidated.move_to_end(key)
+            while len(self._invalidated) > max(self.maxsize, 1):
+                _, generation = self._invalidated.popitem(last=False)
+                self._floor = max(self._floor, generation)
+
+    def clear(self):
+        """Removes every entry"""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._invalidated.clear()
+            self._floor = self._generation
@@ -1,8 +1,9 @@
 """
 Flask CLI Command Extensions
 """
+import click
 from service import app
-from service.models import db
+from service.models import db, ProductStat, Shopcart
 
 
 ######################################################################
@@ -18,3 +19,35 @@ def create_db():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to create the missing tables without touching existing ones
+# Usage: flask init-db
+######################################################################
+@app.cli.command("init-db")
+def init_db():
+    """
+    Creates the tables that do not exist yet. Run it once per deployment
+    so the workers can start with DB_INIT_MODE=verify.
+    """
+    db.create_all()
+    db.session.commit()
+
+
+######################################################################
+# Command to recompute the totals stored on the shopcarts and the product stats
+# Usage: flask repair-totals
+######################################################################
+@app.cli.command("repair-totals")
+@click.option("--batch-size", default=1000, show_default=True, help="Shopcarts per transaction")
+def repair_totals(batch_size):
+    """
+    Recomputes the item count, line count and total price of every
+    shopcart from its products and fixes the ones that drifted, then
+    rebuilds the product stats.
+    """
+    repaired = Shopcart.recompute_totals(batch_size)
+    click.echo("Repaired the totals of {} shopcarts".format(repaired))
+    names = ProductStat.recompute()
+    click.echo("Rebuilt the stats of {} products".format(names))
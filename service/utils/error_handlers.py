@@ -18,7 +18,7 @@
 Module: error_handlers
 """
 from flask import jsonify
-from service.models import DataValidationError
+from service.models import ConcurrencyError, ConflictError, DataValidationError, NotFoundError
 from service import app, api
 from . import status
 
@@ -35,6 +35,42 @@ def request_validation_error(error):
     }, status.HTTP_400_BAD_REQUEST
 
 
+@api.errorhandler(NotFoundError)
+def record_not_found(error):
+    """Handles records that refer to records that do not exist"""
+    message = str(error)
+    app.logger.warning(message)
+    return {
+        "status_code": status.HTTP_404_NOT_FOUND,
+        "error": "Not Found",
+        "message": message,
+    }, status.HTTP_404_NOT_FOUND
+
+
+@api.errorhandler(ConflictError)
+def record_conflict(error):
+    """Handles records that would take the id of another record"""
+    message = str(error)
+    app.logger.warning(message)
+    return {
+        "status_code": status.HTTP_409_CONFLICT,
+        "error": "Conflict",
+        "message": message,
+    }, status.HTTP_409_CONFLICT
+
+
+@api.errorhandler(ConcurrencyError)
+def precondition_failed(error):
+    """Handles updates of records that were changed by someone else"""
+    message = str(error)
+    app.logger.warning(message)
+    return {
+        "status_code": status.HTTP_412_PRECONDITION_FAILED,
+        "error": "Precondition Failed",
+        "message": message,
+    }, status.HTTP_412_PRECONDITION_FAILED
+
+
 '''
 ######################################################################
 # Error Handlers
@@ -0,0 +1,60 @@
+"""
+OpenAPI Spec
+
+This module serves the swagger.json of the API from bytes rendered on
+first use instead of serializing the whole spec on every request. The
+spec only changes with a deployment, so it carries a strong ETag that
+lets clients revalidate it with a 304.
+"""
+import hashlib
+import json
+import threading
+from flask import Response, request
+from service.utils import status
+
+
+class CachedSpec:
+    """The rendered swagger.json of a Flask-RESTX Api"""
+
+    def __init__(self, api, max_age: int = 300):
+        """
+        Args:
+            api: the Flask-RESTX Api to document
+            max_age (int): the seconds clients may use the spec without asking again
+        """
+        self.api = api
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._body = None
+        self._etag = None
+
+    def render(self):
+        """Returns the spec and its ETag, rendering them the first time"""
+        with self._lock:
+            if self._body is None:
+                schema = self.api.__schema__
+                if "error" in schema:
+                    # not cached, so the next request tries again
+                    return None, None
+                settings = self.api.app.config.get("RESTX_JSON", {})
+                self._body = (json.dumps(schema, **settings) + "\n").encode()
+                self._etag = hashlib.sha256(self._body).hexdigest()
+            return self._body, self._etag
+
+    def view(self):
+        """Serves the spec, or 304 when the client already has it"""
+        body, etag = self.render()
+        if body is None:
+            return self.api.__schema__, status.HTTP_500_INTERNAL_SERVER_ERROR
+        response = Response(body, mimetype="application/json")
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = self.max_age
+        return response.make_conditional(request)
+
+
+def cache_spec(app, api, max_age: int = 300) -> CachedSpec:
+    """Replaces the swagger.json view of api with a CachedSpec"""
+    spec = CachedSpec(api, max_age)
+    app.view_functions["specs"] = spec.view
+    return spec
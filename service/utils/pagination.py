@@ -0,0 +1,61 @@
+"""
+Pagination helpers
+
+This module contains the keyset (cursor) pagination helpers used by
+the collection endpoints. A cursor is the opaque, url-safe encoding of
+the last primary key on a page so the next page is a primary key index
+range scan no matter how deep the client pages.
+"""
+import base64
+import binascii
+from urllib.parse import urlencode
+from service.models import DataValidationError
+
+
+def encode_cursor(last_id: int) -> str:
+    """Encodes the last id of a page into an opaque cursor"""
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor back into the last id of the previous page"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (binascii.Error, UnicodeError, ValueError) as error:
+        raise DataValidationError("Invalid cursor: " + cursor) from error
+
+
+def parse_limit(value, default: int, maximum: int) -> int:
+    """Returns the page size requested by the client, capped at maximum"""
+    if value is None:
+        return default
+    try:
+        limit = int(value)
+    except ValueError as error:
+        raise DataValidationError("Invalid limit: " + value) from error
+    if limit < 1:
+        raise DataValidationError("Invalid limit: " + value)
+    return min(limit, maximum)
+
+
+def next_page(request, items: list, limit: int):
+    """
+    Trims a page fetched with limit + 1 rows and builds its Link header
+    Args:
+        request: the current Flask request
+        items (list): the rows or their dictionaries, at most limit + 1 of them
+        limit (int): the page size
+    Returns the page and the response headers for it
+    """
+    if len(items) <= limit:
+        return items, {}
+    items = items[:limit]
+    args = request.args.to_dict()
+    args["limit"] = limit
+    last = items[-1]
+    args["after"] = encode_cursor(last["id"] if isinstance(last, dict) else last.id)
+    link = '<{}?{}>; rel="next"'.format(request.base_url, urlencode(args))
+    return items, {"Link": link}
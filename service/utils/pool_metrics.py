@@ -0,0 +1,123 @@
+"""
+Pool Metrics
+
+This module contains a connection pool that keeps telemetry about how
+long requests wait for a database connection, so pool starvation can be
+told apart from a slow database. The wait is only the time spent in the
+pool's queue; opening new connections is counted on its own and the
+pre-ping of a checkout is in neither.
+"""
+import bisect
+import os
+import threading
+import time
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+# Upper bounds in milliseconds of the connection wait time histogram
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class PoolMetrics:
+    """Thread-safe counters about the connection checkouts of one pool"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.connects = 0
+        self.connect_seconds = 0.0
+        # one extra bucket for waits longer than the last bound
+        self.wait_buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+
+    def record_wait(self, seconds: float):
+        """Records how long a checkout waited for a connection"""
+        index = bisect.bisect_left(WAIT_BUCKETS_MS, seconds * 1000)
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds += seconds
+            self.wait_buckets[index] += 1
+
+    def record_connect(self, seconds: float):
+        """Records how long opening a new database connection took"""
+        with self._lock:
+            self.connects += 1
+            self.connect_seconds += seconds
+
+    def record_timeout(self):
+        """Records a checkout that gave up waiting for a connection"""
+        with self._lock:
+            self.timeouts += 1
+
+    def as_dict(self) -> dict:
+        """Returns the counters with the histogram keyed by bucket bound"""
+        with self._lock:
+            buckets = list(self.wait_buckets)
+            counters = {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": round(self.wait_seconds, 6),
+                "connects": self.connects,
+                "connect_seconds_total": round(self.connect_seconds, 6),
+            }
+        bounds = [str(bound) for bound in WAIT_BUCKETS_MS] + ["+Inf"]
+        counters["wait_ms_histogram"] = dict(zip(bounds, buckets))
+        return counters
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    A QueuePool that records the wait time of every checkout and the time
+    taken by every new connection
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+        # the connect time of the checkout running in this thread, which
+        # is taken out of its wait
+        self._checkout = threading.local()
+
+    def _do_get(self):
+        # QueuePool._do_get() calls itself again when it loses a race for
+        # an overflow slot, and only the outermost call is one checkout
+        if getattr(self._checkout, "connect_seconds", None) is not None:
+            return super()._do_get()
+        self._checkout.connect_seconds = 0.0
+        start = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.record_timeout()
+            raise
+        finally:
+            connect_seconds = self._checkout.connect_seconds
+            self._checkout.connect_seconds = None
+        self.metrics.record_wait(time.perf_counter() - start - connect_seconds)
+        return record
+
+    def _create_connection(self):
+        start = time.perf_counter()
+        record = super()._create_connection()
+        seconds = time.perf_counter() - start
+        self.metrics.record_connect(seconds)
+        if getattr(self._checkout, "connect_seconds", None) is not None:
+            self._checkout.connect_seconds += seconds
+        return record
+
+
+def pool_status(pool) -> dict:
+    """Returns the state of a pool and the telemetry of this worker"""
+    report = {"pid": os.getpid(), "pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        report.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+        )
+    metrics = getattr(pool, "metrics", None)
+    if metrics is not None:
+        report.update(metrics.as_dict())
+    return report
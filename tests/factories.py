@@ -40,7 +40,9 @@ class ProductFactory(factory.Factory):
 
     id = factory.Sequence(lambda n: n)
     shopcart_id = None
-    name = FuzzyChoice(choices=["apple", "peach", "banana", "pear", "cake"])
+    # a Shopcart holds one Product per name and price, so products made
+    # for the same Shopcart must not share a name by chance
+    name = factory.Sequence(lambda n: "product-{}".format(n))
     quantity = FuzzyChoice(choices=[0, 1, 2, 3, 4])
     price = FuzzyChoice(choices=[0.99, 1.99, 2.99, 3.99, 4.99])
     # shopcart = factory.SubFactory(ShopCartFactory)
@@ -0,0 +1,87 @@
+"""
+Test cases for the LRU cache
+"""
+from unittest import TestCase
+from service.utils.cache import LRUCache
+
+
+class FakeClock:
+    """A clock that only moves when told to"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache(TestCase):
+    """LRU Cache Tests"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = LRUCache(maxsize=2, ttl=10, clock=self.clock)
+
+    def test_get_and_set(self):
+        """It should return what was cached and None otherwise"""
+        self.assertIsNone(self.cache.get(1))
+        self.cache.set(1, {"id": 1})
+        self.assertEqual(self.cache.get(1), {"id": 1})
+        self.assertEqual(len(self.cache), 1)
+
+    def test_expire(self):
+        """It should drop entries older than the time to live"""
+        self.cache.set(1, "one")
+        self.clock.now = 9.9
+        self.assertEqual(self.cache.get(1), "one")
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_evict_least_recently_used(self):
+        """It should evict the least recently used entry when full"""
+        self.cache.set(1, "one")
+        self.cache.set(2, "two")
+        self.cache.get(1)
+        self.cache.set(3, "three")
+        self.assertEqual(self.cache.get(1), "one")
+        self.assertIsNone(self.cache.get(2))
+        self.assertEqual(self.cache.get(3), "three")
+
+    def test_invalidate_and_clear(self):
+        """It should drop invalidated entries and everything on clear"""
+        self.cache.set(1, "one")
+        self.cache.set(2, "two")
+        self.cache.invalidate(1, 42)
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.get(2), "two")
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_set_after_invalidate(self):
+        """It should not cache a value read before its key was invalidated"""
+        generation = self.cache.generation()
+        self.cache.invalidate(1)
+        self.cache.set(1, "stale", generation)
+        self.assertIsNone(self.cache.get(1))
+        self.cache.set(2, "two", generation)
+        self.assertEqual(self.cache.get(2), "two")
+        self.cache.set(1, "one", self.cache.generation())
+        self.assertEqual(self.cache.get(1), "one")
+
+    def test_set_after_forgotten_invalidate(self):
+        """It should not cache a value older than the invalidations it remembers"""
+        generation = self.cache.generation()
+        self.cache.invalidate(1, 2, 3)
+        self.cache.set(4, "four", generation)
+        self.assertIsNone(self.cache.get(4))
+        generation = self.cache.generation()
+        self.cache.clear()
+        self.cache.set(4, "four", generation)
+        self.assertIsNone(self.cache.get(4))
+
+    def test_disabled(self):
+        """It should not cache anything when the size is 0"""
+        cache = LRUCache(maxsize=0)
+        cache.set(1, "one")
+        self.assertIsNone(cache.get(1))
@@ -1,7 +1,7 @@
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
-from service.utils.cli_commands import create_db
+from service.utils.cli_commands import create_db, init_db, repair_totals
 
 
 class TestFlaskCLI(TestCase):
@@ -16,3 +16,24 @@ class TestFlaskCLI(TestCase):
         db_mock.return_value = MagicMock()
         result = self.runner.invoke(create_db)
         self.assertEqual(result.exit_code, 0)
+
+    @patch("service.utils.cli_commands.db")
+    def test_init_db(self, db_mock):
+        """It should create the missing tables without dropping any"""
+        result = self.runner.invoke(init_db)
+        self.assertEqual(result.exit_code, 0)
+        db_mock.create_all.assert_called_once()
+        db_mock.drop_all.assert_not_called()
+
+    @patch("service.utils.cli_commands.ProductStat")
+    @patch("service.utils.cli_commands.Shopcart")
+    def test_repair_totals(self, shopcart_mock, stat_mock):
+        """It should recompute the totals of the shopcarts and the product stats"""
+        shopcart_mock.recompute_totals.return_value = 3
+        stat_mock.recompute.return_value = 5
+        result = self.runner.invoke(repair_totals, ["--batch-size", "50"])
+        self.assertEqual(result.exit_code, 0)
+        shopcart_mock.recompute_totals.assert_called_once_with(50)
+        stat_mock.recompute.assert_called_once()
+        self.assertIn("3 shopcarts", result.output)
+        self.assertIn("5 products", result.output)
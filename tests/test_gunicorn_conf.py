@@ -0,0 +1,84 @@
+"""
+Gunicorn Configuration Test Suite
+
+Test cases can be run with the following:
+  nosetests -v --with-spec --spec-color
+  coverage report -m
+"""
+import os
+import tempfile
+import importlib.util
+from unittest import TestCase
+
+CONF_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "gunicorn.conf.py")
+spec = importlib.util.spec_from_file_location("gunicorn_conf", CONF_PATH)
+conf = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(conf)
+
+MB = 1024 * 1024
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+
+
+class TestGunicornConf(TestCase):
+    """Gunicorn Configuration Tests"""
+
+    def setUp(self):
+        """Runs before each test"""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+
+    def tearDown(self):
+        """Runs once after each test case"""
+        self.tmp.cleanup()
+
+    def _write(self, path, value):
+        """Writes a fake cgroup file"""
+        path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(value + "\n")
+
+    def test_no_cgroup(self):
+        """It should report no limits without a cgroup"""
+        self.assertIsNone(conf.cpu_limit(self.root))
+        self.assertIsNone(conf.memory_limit(self.root))
+        self.assertGreaterEqual(conf.available_cores(self.root), 1)
+
+    def test_cgroup_v2_limits(self):
+        """It should read the cgroup v2 cpu and memory limits"""
+        self._write("cpu.max", "150000 100000")
+        self._write("memory.max", str(256 * MB))
+        self.assertEqual(conf.cpu_limit(self.root), 1.5)
+        self.assertEqual(conf.memory_limit(self.root), 256 * MB)
+        self.assertLessEqual(conf.available_cores(self.root), 2)
+        self.assertEqual(conf.available_memory(self.root), 256 * MB)
+
+    def test_cgroup_v2_unlimited(self):
+        """It should treat max as no limit"""
+        self._write("cpu.max", "max 100000")
+        self._write("memory.max", "max")
+        self.assertIsNone(conf.cpu_limit(self.root))
+        self.assertIsNone(conf.memory_limit(self.root))
+
+    def test_cgroup_v1_limits(self):
+        """It should read the cgroup v1 cpu and memory limits"""
+        self._write("cpu/cpu.cfs_quota_us", "20000")
+        self._write("cpu/cpu.cfs_period_us", "100000")
+        self._write("memory/memory.limit_in_bytes", str(64 * MB))
+        self.assertEqual(conf.cpu_limit(self.root), 0.2)
+        self.assertEqual(conf.available_cores(self.root), 1)
+        self.assertEqual(conf.memory_limit(self.root), 64 * MB)
+        self._write("cpu/cpu.cfs_quota_us", "-1")
+        self._write("memory/memory.limit_in_bytes", str(1 << 62))
+        self.assertIsNone(conf.cpu_limit(self.root))
+        self.assertIsNone(conf.memory_limit(self.root))
+
+    def test_worker_count(self):
+        """It should size the workers from the cores within the memory"""
+        self.assertEqual(conf.worker_count(4, None, 48), 9)
+        self.assertEqual(conf.worker_count(4, 256 * MB, 48), 5)
+        self.assertEqual(conf.worker_count(1, 32 * MB, 48), 1)
@@ -5,11 +5,13 @@ Test cases for YourResourceModel Model
 import logging
 import os
 import unittest
+from unittest.mock import patch
+from sqlalchemy import event, text
 
 # from sqlalchemy import null
 # from werkzeug.exceptions import NotFound
-from service.models import DataValidationError
-from service.models import Product, Shopcart, db
+from service.models import ConcurrencyError, ConflictError, DataValidationError, NotFoundError
+from service.models import Product, ProductStat, Shopcart, db, trigram_search
 from service import app
 from tests.factories import ShopCartFactory, ProductFactory
 
@@ -40,17 +42,47 @@ class TestShopCart(unittest.TestCase):
 
     def setUp(self):
         """This runs before each test"""
+        self.app_context = app.app_context()
+        self.app_context.push()
         db.session.query(Product).delete()
         db.session.query(Shopcart).delete()  # clean up the last tests
+        db.session.query(ProductStat).delete()
         db.session.commit()
 
     def tearDown(self):
         """This runs after each test"""
         db.session.remove()
+        self.app_context.pop()
+
+    def _count_statements(self, function):
+        """Runs function and returns its result and the SQL statements it sent"""
+        statements = []
+
+        def count_statement(*args):
+            statements.append(args[2])
+
+        event.listen(db.engine, "before_cursor_execute", count_statement)
+        try:
+            result = function()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count_statement)
+        return result, statements
 
     ######################################################################
     #  T E S T   C A S E S
     ######################################################################
+    def test_init_db_verify(self):
+        """It should only check the connection when DB_INIT_MODE is verify"""
+        app.config["DB_INIT_MODE"] = "verify"
+        try:
+            with patch.object(db, "create_all") as create_all:
+                Shopcart.init_db(app)
+            create_all.assert_not_called()
+            app.config["DB_INIT_MODE"] = "migrate"
+            self.assertRaises(ValueError, Shopcart.init_db, app)
+        finally:
+            app.config["DB_INIT_MODE"] = "create"
+
     def test_create_a_shopcart(self):
         """It should Create an Shopcart and assert that it exists"""
         fake_shopcart = ShopCartFactory()
@@ -108,6 +140,23 @@ class TestShopCart(unittest.TestCase):
         shopcarts = Shopcart.all()
         self.assertEqual(len(shopcarts), 5)
 
+    def test_list_all_shopcarts_query_count(self):
+        """It should List Shopcarts and their products in a constant number of queries"""
+        for _ in range(5):
+            shopcart = ShopCartFactory()
+            shopcart.products.append(ProductFactory())
+            shopcart.products.append(ProductFactory())
+            shopcart.create(shopcart.id)
+        db.session.expunge_all()
+
+        results, statements = self._count_statements(
+            lambda: [shopcart.serialize() for shopcart in Shopcart.all()]
+        )
+        self.assertEqual(len(results), 5)
+        for result in results:
+            self.assertEqual(len(result["products"]), 2)
+        self.assertEqual(len(statements), 2)
+
     def test_find_by_customer_id(self):
         """It should Find an Shopcart by customer id"""
         shopcart = ShopCartFactory()
@@ -142,6 +191,97 @@ class TestShopCart(unittest.TestCase):
         new_shopcart.deserialize(serial_shopcart)
         self.assertEqual(new_shopcart.id, shopcart.id)
 
+    def test_filter_shopcarts_by_product_no_duplicates(self):
+        """It should return a Shopcart once even if it holds the product twice"""
+        shopcart = ShopCartFactory()
+        shopcart.products.append(ProductFactory(name="apple", price=1.0))
+        shopcart.products.append(ProductFactory(name="apple", price=2.0))
+        shopcart.products.append(ProductFactory(name="pear"))
+        shopcart.create(shopcart.id)
+        other = ShopCartFactory()
+        other.products.append(ProductFactory(name="pear"))
+        other.create(other.id)
+        filtered_shopcarts = Shopcart.filter_by_product_name("apple")
+        self.assertEqual(len(filtered_shopcarts), 1)
+        self.assertEqual(filtered_shopcarts[0].id, shopcart.id)
+        self.assertEqual(len(filtered_shopcarts[0].products), 3)
+
+    def test_deserialize_shopcart_diff(self):
+        """It should only write the products that changed when deserializing"""
+        shopcart = ShopCartFactory()
+        for _ in range(3):
+            shopcart.products.append(ProductFactory())
+        shopcart.create(shopcart.id)
+        shopcart = Shopcart.find_by_id(shopcart.id)
+        data = shopcart.serialize()
+        kept, changed, removed = data["products"]
+        changed["quantity"] += 10
+        added = ProductFactory().serialize()
+        data["products"] = [kept, changed, added]
+
+        _, statements = self._count_statements(lambda: shopcart.deserialize(data))
+        writes = [
+            s.split()[0] for s in statements
+            if " product" in s and "product_stat" not in s and not s.startswith("SELECT")
+        ]
+        self.assertEqual(sorted(writes), ["DELETE", "INSERT", "UPDATE"])
+        self.assertEqual(len([s for s in statements if "product_stat" in s]), 1)
+
+        products = Shopcart.find_by_id(shopcart.id).serialize()["products"]
+        by_id = {product["id"]: product for product in products}
+        self.assertEqual(len(by_id), 3)
+        self.assertEqual(by_id.pop(kept["id"]), kept)
+        self.assertEqual(by_id.pop(changed["id"]), changed)
+        self.assertNotIn(removed["id"], by_id)
+        new_product = by_id.popitem()[1]
+        self.assertEqual(new_product["name"], added["name"])
+        self.assertEqual(new_product["shopcart_id"], shopcart.id)
+
+    def test_shopcart_version(self):
+        """It should bump the version of a shopcart whenever it changes"""
+        shopcart = ShopCartFactory()
+        shopcart.create(shopcart.id)
+        versions = [Shopcart.find_by_id(shopcart.id).version]
+        product = ProductFactory(shopcart_id=shopcart.id)
+        product.create()
+        versions.append(Shopcart.find_by_id(shopcart.id).version)
+        product.quantity += 1
+        product.update()
+        versions.append(Shopcart.find_by_id(shopcart.id).version)
+        product.delete()
+        versions.append(Shopcart.find_by_id(shopcart.id).version)
+        versions.append(Shopcart.touch(shopcart.id))
+        self.assertEqual(versions, sorted(set(versions)))
+        self.assertIsNone(Shopcart.touch(shopcart.id + 1))
+
+    def test_shopcart_version_after_recreate(self):
+        """It should not repeat the versions of a deleted Shopcart when it is created again"""
+        shopcart = ShopCartFactory()
+        shopcart.create(shopcart.id)
+        shopcart_id = shopcart.id
+        old_version = Shopcart.find_by_id(shopcart_id).version
+        Shopcart.find_by_id(shopcart_id).delete()
+        Shopcart(id=shopcart_id).create(shopcart_id)
+        self.assertGreater(Shopcart.find_by_id(shopcart_id).version, old_version)
+
+    def test_update_product_changed_concurrently(self):
+        """It should not Update a product that was changed since it was read"""
+        shopcart = ShopCartFactory()
+        shopcart.create(shopcart.id)
+        product = ProductFactory(shopcart_id=shopcart.id)
+        product.create()
+        product = Product.find(product.id)
+        self.assertEqual(product.version, 1)
+        # another writer updates the row behind the session's back
+        db.session.execute(
+            Product.__table__.update()
+            .where(Product.id == product.id)
+            .values(quantity=9, version=2)
+        )
+        product.quantity = 5
+        self.assertRaises(ConcurrencyError, product.update)
+        self.assertRaises(ConcurrencyError, Product.find(product.id).update, [7])
+
     def test_shopcart_repr(self):
         """It should Repr a shopcart"""
         shopcart = ShopCartFactory()
@@ -159,6 +299,44 @@ class TestShopCart(unittest.TestCase):
         self.assertEqual(len(Shopcart.all()), 1)
         self.assertEqual(Shopcart.all()[0], shopcart2)
 
+    def test_shopcart_delete_products_in_bulk(self):
+        """It should Delete a shopcart's products with one statement"""
+        shopcart = ShopCartFactory()
+        for _ in range(5):
+            shopcart.products.append(ProductFactory())
+        shopcart.create(shopcart.id)
+        shopcart = Shopcart.find_by_id(shopcart.id)
+        self.assertEqual(len(shopcart.products), 5)
+
+        _, statements = self._count_statements(shopcart.delete)
+        # the lock on the shopcart, the products, their stats and the shopcart
+        self.assertEqual(
+            [s.split()[0] for s in statements], ["UPDATE", "DELETE", "INSERT", "DELETE"]
+        )
+        self.assertEqual(Product.query.count(), 0)
+        self.assertEqual(Shopcart.all(), [])
+
+    def test_clear_shopcart(self):
+        """It should Clear a shopcart's products with one statement"""
+        shopcart = ShopCartFactory()
+        for _ in range(5):
+            shopcart.products.append(ProductFactory())
+        shopcart.create(shopcart.id)
+        shopcart = Shopcart.find_by_id(shopcart.id)
+
+        def clear():
+            shopcart.clear()
+            return shopcart.serialize()
+
+        version = shopcart.version
+        data, statements = self._count_statements(clear)
+        # the shopcart, the products and the stats of the products
+        self.assertEqual([s.split()[0] for s in statements], ["UPDATE", "DELETE", "INSERT"])
+        self.assertEqual(data, {"id": shopcart.id, "products": []})
+        self.assertGreater(shopcart.version, version)
+        self.assertEqual(Product.query.count(), 0)
+        self.assertEqual(len(Shopcart.all()), 1)
+
     def test_deserialize_with_key_error(self):
         """It should not Deserialize an shopcart with a KeyError"""
         shopcart = Shopcart()
@@ -179,6 +357,252 @@ class TestShopCart(unittest.TestCase):
         product = Product()
         self.assertRaises(DataValidationError, product.deserialize, [])
 
+    def test_validate_product(self):
+        """It should validate and type a Product in a single pass"""
+        data = {"shopcart_id": "3", "name": "pear", "price": "1.5", "quantity": 2}
+        values = Product.request_schema.validate(data)
+        self.assertEqual(
+            values, {"id": None, "shopcart_id": 3, "name": "pear", "price": 1.5, "quantity": 2}
+        )
+        values = Product.request_schema.validate(dict(data, quantity=2.0))
+        self.assertIs(type(values["quantity"]), int)
+        messages = {
+            "Invalid Product: missing name": {"shopcart_id": None, "price": 1, "quantity": 1},
+            "Invalid Product: name must not be null": dict(data, name=None),
+            "Invalid Product: body of request contained bad data - quantity: "
+            "invalid literal for int() with base 10: 'many'": dict(data, quantity="many"),
+            "Invalid Product: body of request contained bad data - name: "
+            "expected a string, got int": dict(data, name=7),
+            "Invalid Product: body of request contained bad data - name: "
+            "must be at most 260 characters long": dict(data, name="x" * 261),
+            "Invalid Product: body of request contained bad data - quantity: "
+            "expected an integer, got 3.9": dict(data, quantity=3.9),
+            "Invalid Product: body of request contained bad data - quantity: "
+            "expected an integer, got bool": dict(data, quantity=True),
+            "Invalid Product: body of request contained bad data - quantity: "
+            "must be between 0 and 2147483647": dict(data, quantity=-1),
+            "Invalid Product: body of request contained bad data - price: "
+            "expected a number, got bool": dict(data, price=False),
+            "Invalid Product: body of request contained bad data - price: "
+            "expected a finite number, got nan": dict(data, price=float("nan")),
+            "Invalid Product: body of request contained bad or no data": [],
+        }
+        for message, bad_data in messages.items():
+            with self.assertRaises(DataValidationError) as context:
+                Product.request_schema.validate(bad_data)
+            self.assertEqual(str(context.exception), message)
+
+    def test_validate_shopcart(self):
+        """It should validate a Shopcart together with its Products"""
+        product = ProductFactory().serialize()
+        values = Shopcart.request_schema.validate({"id": "4", "products": [product]})
+        self.assertEqual(values["id"], 4)
+        self.assertEqual(values["products"][0]["name"], product["name"])
+        del product["price"]
+        with self.assertRaises(DataValidationError) as context:
+            Shopcart.request_schema.validate({"id": 4, "products": [product]})
+        self.assertEqual(str(context.exception), "Invalid Product: missing price")
+        with self.assertRaises(DataValidationError) as context:
+            Shopcart.request_schema.validate({"id": 4, "products": {}})
+        self.assertIn("products: expected a list", str(context.exception))
+
+    def test_summaries(self):
+        """It should read the totals of Shopcarts in a single query"""
+        shopcart = ShopCartFactory()
+        shopcart.create(shopcart.id)
+        empty = ShopCartFactory()
+        empty.create(empty.id)
+        products = [ProductFactory(shopcart_id=shopcart.id) for _ in range(3)]
+        for product in products:
+            product.create()
+        ids = [empty.id, shopcart.id, 0]
+        summaries, statements = self._count_statements(lambda: Shopcart.summaries(ids))
+        self.assertEqual(len(statements), 1)
+        self.assertEqual([summary["id"] for summary in summaries], sorted([shopcart.id, empty.id]))
+        totals = {summary["id"]: summary for summary in summaries}
+        self.assertEqual(totals[shopcart.id]["line_count"], 3)
+        self.assertEqual(
+            totals[shopcart.id]["item_count"], sum(product.quantity for product in products)
+        )
+        self.assertAlmostEqual(
+            totals[shopcart.id]["total_price"],
+            sum(product.price * product.quantity for product in products),
+        )
+        self.assertEqual(totals[empty.id]["line_count"], 0)
+        self.assertEqual(totals[empty.id]["item_count"], 0)
+        self.assertEqual(totals[empty.id]["total_price"], 0)
+
+    def _assert_totals(self, shopcart_id):
+        """Asserts the stored totals of a Shopcart match its products"""
+        db.session.expire_all()
+        shopcart = Shopcart.find_by_id(shopcart_id)
+        products = shopcart.products
+        self.assertEqual(shopcart.line_count, len(products))
+        self.assertEqual(shopcart.item_count, sum(product.quantity for product in products))
+        self.assertAlmostEqual(
+            shopcart.total_price, sum(product.price * product.quantity for product in products)
+        )
+
+    def test_totals_follow_products(self):
+        """It should keep the totals of Shopcarts in step with every change"""
+        shopcart = ShopCartFactory()
+        ProductFactory(shopcart=shopcart)
+        shopcart.create(shopcart.id)
+        other = ShopCartFactory()
+        other.create(other.id)
+        self._assert_totals(shopcart.id)
+        product = ProductFactory(shopcart_id=shopcart.id)
+        product.create()
+        self._assert_totals(shopcart.id)
+        data = [ProductFactory().serialize() for _ in range(3)]
+        Product.create_many(shopcart.id, data)
+        self._assert_totals(shopcart.id)
+        product = Product.find(product.id)
+        product.quantity += 5
+        product.price = 9.5
+        product.update()
+        self._assert_totals(shopcart.id)
+        product = Product.find(product.id)
+        product.shopcart_id = other.id
+        product.update()
+        self._assert_totals(shopcart.id)
+        self._assert_totals(other.id)
+        Product.find(product.id).delete()
+        self._assert_totals(other.id)
+        stored = Shopcart.find_by_id(shopcart.id)
+        data = stored.serialize()
+        data["products"][0]["quantity"] = 7
+        data["products"].pop()
+        data["products"].append(ProductFactory().serialize())
+        del data["products"][-1]["id"]
+        stored.deserialize(data)
+        self._assert_totals(shopcart.id)
+        Shopcart.find_by_id(shopcart.id).clear()
+        self._assert_totals(shopcart.id)
+
+    def test_recompute_totals(self):
+        """It should repair the totals of Shopcarts that drifted"""
+        shopcarts = []
+        for _ in range(3):
+            shopcart = ShopCartFactory()
+            shopcart.create(shopcart.id)
+            ProductFactory(shopcart_id=shopcart.id, quantity=2).create()
+            shopcarts.append(shopcart.id)
+        db.session.execute(
+            Shopcart.__table__.update()
+            .where(Shopcart.id == shopcarts[1])
+            .values(line_count=9, item_count=9, total_price=99.0)
+        )
+        db.session.commit()
+        version = Shopcart.find_by_id(shopcarts[1]).version
+        self.assertEqual(Shopcart.recompute_totals(batch_size=2), 1)
+        for shopcart_id in shopcarts:
+            self._assert_totals(shopcart_id)
+        self.assertGreater(Shopcart.find_by_id(shopcarts[1]).version, version)
+        self.assertEqual(Shopcart.recompute_totals(), 0)
+
+    def _assert_stats(self):
+        """Asserts the ProductStats match the Products in every Shopcart"""
+        expected = {}
+        for product in Product.all():
+            totals = expected.setdefault(product.name, [0, 0, 0.0])
+            totals[0] += 1
+            totals[1] += product.quantity
+            totals[2] += product.quantity * product.price
+        stats = {stat.name: stat for stat in ProductStat.query.all() if stat.line_count}
+        self.assertEqual(set(stats), set(expected))
+        for name, (line_count, total_quantity, total_value) in expected.items():
+            self.assertEqual(stats[name].line_count, line_count)
+            self.assertEqual(stats[name].total_quantity, total_quantity)
+            self.assertAlmostEqual(stats[name].total_value, total_value)
+
+    def test_stats_follow_products(self):
+        """It should keep the ProductStats in step with every change"""
+        shopcart = ShopCartFactory()
+        shopcart.products.append(ProductFactory(name="apple"))
+        shopcart.create(shopcart.id)
+        self._assert_stats()
+        ProductFactory(shopcart_id=shopcart.id, name="pear").create()
+        Product.create_many(shopcart.id, [ProductFactory(name="apple").serialize()] * 2)
+        self._assert_stats()
+        product = Product.find_by_shopcart(shopcart.id)[0]
+        product.name = "cake"
+        product.quantity += 1
+        product.update()
+        self._assert_stats()
+        Product.find(product.id).delete()
+        self._assert_stats()
+        stored = Shopcart.find_by_id(shopcart.id)
+        data = stored.serialize()
+        data["products"][0]["price"] += 1
+        data["products"].pop()
+        data["products"].append(ProductFactory(name="peach").serialize())
+        del data["products"][-1]["id"]
+        stored.deserialize(data)
+        self._assert_stats()
+        other = ShopCartFactory()
+        other.create(other.id)
+        ProductFactory(shopcart_id=other.id, name="peach").create()
+        Shopcart.find_by_id(shopcart.id).clear()
+        self._assert_stats()
+        Shopcart.find_by_id(other.id).delete()
+        self._assert_stats()
+
+    def test_top_products(self):
+        """It should order the ProductStats by the column asked for"""
+        for name, quantity, price in (("apple", 1, 9.0), ("pear", 5, 1.0), ("apple", 1, 9.0)):
+            shopcart = ShopCartFactory()
+            shopcart.create(shopcart.id)
+            ProductFactory(shopcart_id=shopcart.id, name=name, quantity=quantity, price=price).create()
+        by_carts = ProductStat.top("line_count", 10)
+        self.assertEqual([stat.name for stat in by_carts], ["apple", "pear"])
+        self.assertEqual(by_carts[0].line_count, 2)
+        self.assertEqual([stat.name for stat in ProductStat.top("total_quantity", 10)], ["pear", "apple"])
+        self.assertEqual([stat.name for stat in ProductStat.top("total_value", 1)], ["apple"])
+        self.assertRaises(DataValidationError, ProductStat.top, "name")
+
+    def test_recompute_stats(self):
+        """It should rebuild the ProductStats from the Products"""
+        shopcart = ShopCartFactory()
+        for name, price in (("apple", 1.0), ("apple", 2.0), ("pear", 1.0)):
+            shopcart.products.append(ProductFactory(name=name, price=price))
+        shopcart.create(shopcart.id)
+        db.session.query(ProductStat).delete()
+        ProductStat.record({"cake": (3, 3, 3.0)})
+        db.session.commit()
+        self.assertEqual(ProductStat.recompute(), 2)
+        self._assert_stats()
+        self.assertIsNone(ProductStat.query.get("cake"))
+
+    def test_search(self):
+        """It should find Shopcarts by the start or a part of a product name"""
+        ids = {}
+        for name in ("Apple Pie", "apple", "Pineapple", "grape", "100%_juice"):
+            shopcart = ShopCartFactory()
+            shopcart.products.append(ProductFactory(name=name))
+            shopcart.create(shopcart.id)
+            ids[name] = shopcart.id
+        found = [shopcart.id for shopcart in Shopcart.search(name_prefix="APP")]
+        self.assertEqual(found, [ids["apple"], ids["Apple Pie"]])
+        found = [shopcart.id for shopcart in Shopcart.search(q="apple")]
+        self.assertEqual(found[:2], [ids["apple"], ids["Apple Pie"]])
+        self.assertIn(ids["Pineapple"], found)
+        self.assertNotIn(ids["grape"], found)
+        self.assertEqual(len(Shopcart.search(q="apple", limit=1)), 1)
+        # wildcards are searched for literally
+        found = [shopcart.id for shopcart in Shopcart.search(q="%_")]
+        self.assertEqual(found, [ids["100%_juice"]])
+        self.assertEqual(Shopcart.search(name_prefix="_"), [])
+        self.assertEqual(Shopcart.search(q="kiwi"), [])
+
+    def test_search_indexes(self):
+        """It should index product names for prefix searches on Postgres"""
+        query = text("SELECT indexname FROM pg_indexes WHERE tablename = 'product'")
+        indexes = db.session.execute(query).scalars().all()
+        self.assertIn("ix_product_name_prefix", indexes)
+        if trigram_search():
+            self.assertIn("ix_product_name_trgm", indexes)
+
     def test_add_shopcart_product(self):
         """It should Create a shopcart with a product and add it to the database"""
         shopcarts = Shopcart.all()
@@ -286,6 +710,71 @@ class TestShopCart(unittest.TestCase):
         shopcart = Shopcart.find_by_id(shopcart.id)
         self.assertEqual(len(shopcart.products), 0)
 
+    def test_product_constraint_errors(self):
+        """It should tell apart the constraints a write of a Product breaks"""
+        shopcart = ShopCartFactory()
+        shopcart.create(shopcart.id)
+        other = ShopCartFactory()
+        other.create(other.id)
+        shopcart_id, other_id = shopcart.id, other.id
+        self.assertRaises(NotFoundError, ProductFactory(shopcart_id=other_id + 1000).create)
+        first = ProductFactory(shopcart_id=shopcart_id)
+        first.create()
+        product = ProductFactory(shopcart_id=shopcart_id)
+        product.create()
+        product.name, product.price = first.name, first.price
+        self.assertRaises(DataValidationError, product.update)
+        product = Product.find(product.id)
+        product.shopcart_id = None
+        self.assertRaises(DataValidationError, product.update)
+        product = Product.find(product.id)
+        product.shopcart_id = other_id + 1000
+        self.assertRaises(NotFoundError, product.update)
+        data = Shopcart.find_by_id(other_id).serialize()
+        data["id"] = shopcart_id
+        self.assertRaises(ConflictError, Shopcart.find_by_id(other_id).deserialize, data)
+        data = Shopcart.find_by_id(shopcart_id).serialize()
+        data["id"] = other_id + 1000
+        self.assertRaises(DataValidationError, Shopcart.find_by_id(shopcart_id).deserialize, data)
+        self._assert_totals(shopcart_id)
+
+    def test_delete_product_changed_concurrently(self):
+        """It should Delete a product changed since it was read only without versions"""
+        shopcart = ShopCartFactory()
+        shopcart.create(shopcart.id)
+        product = ProductFactory(shopcart_id=shopcart.id, quantity=2)
+        product.create()
+        shopcart_id, product_id = shopcart.id, product.id
+        product = Product.find(product_id)
+        # another writer changes the row after it was read
+        Product.add_quantity(shopcart_id, product_id, 7)
+        self.assertRaises(ConcurrencyError, product.delete, [1])
+        self.assertIsNotNone(Product.find(product_id))
+        # the totals are moved by the deleted row, not by what was read
+        self.assertEqual(product.delete()["quantity"], 9)
+        self.assertIsNone(Product.find(product_id))
+        self._assert_totals(shopcart_id)
+        self._assert_stats()
+        self.assertIsNone(Product.remove(shopcart_id, product_id))
+
+    def test_product_writes_lock_shopcart_first(self):
+        """It should lock the Shopcart before the Product on every Product write"""
+        shopcart = ShopCartFactory()
+        shopcart.create(shopcart.id)
+        shopcart_id = shopcart.id
+
+        def first_write(function):
+            _, statements = self._count_statements(function)
+            return [s for s in statements if not s.startswith("SELECT")][0]
+
+        product = ProductFactory(shopcart_id=shopcart_id)
+        self.assertTrue(first_write(product.create).startswith("UPDATE shopcart"))
+        product = Product.find(product.id)
+        product.quantity += 1
+        self.assertTrue(first_write(product.update).startswith("UPDATE shopcart"))
+        product = Product.find(product.id)
+        self.assertTrue(first_write(product.delete).startswith("UPDATE shopcart"))
+
     def test_create_a_product(self):
         """It should Create a product and assert that it exists"""
         shopcart = ShopCartFactory()
@@ -295,6 +784,121 @@ class TestShopCart(unittest.TestCase):
         same_product = Product.find(product.id)
         self.assertEqual(product.id, same_product.id)
 
+    def test_create_product_merges_lines(self):
+        """It should add the quantity of a Product to the same line of its Shopcart"""
+        shopcart = ShopCartFactory()
+        shopcart.create(shopcart.id)
+        product = ProductFactory(shopcart_id=shopcart.id, name="apple", price=1.5, quantity=2)
+        self.assertTrue(product.create())
+        same = ProductFactory(shopcart_id=shopcart.id, name="apple", price=1.5, quantity=3)
+        self.assertFalse(same.create())
+        self.assertEqual(same.id, product.id)
+        self.assertEqual(same.quantity, 5)
+        self.assertEqual(same.version, 2)
+        other_price = ProductFactory(shopcart_id=shopcart.id, name="apple", price=2.0)
+        self.assertTrue(other_price.create())
+        self.assertEqual(len(Product.find_by_shopcart(shopcart.id)), 2)
+        self._assert_totals(shopcart.id)
+        self._assert_stats()
+        Product.create_many(
+            shopcart.id,
+            [
+                {"shopcart_id": None, "name": "apple", "price": 1.5, "quantity": 1},
+                {"shopcart_id": None, "name": "pear", "price": 1.0, "quantity": 1},
+                {"shopcart_id": None, "name": "pear", "price": 1.0, "quantity": 4},
+            ],
+        )
+        quantities = {(p.name, p.price): p.quantity for p in Product.find_by_shopcart(shopcart.id)}
+        self.assertEqual(quantities, {("apple", 1.5): 6, ("apple", 2.0): other_price.quantity, ("pear", 1.0): 5})
+        self._assert_totals(shopcart.id)
+        self._assert_stats()
+
+    def test_update_product_into_another_line(self):
+        """It should not give a Product the name and price of another one in its Shopcart"""
+        shopcart = ShopCartFactory()
+        shopcart.create(shopcart.id)
+        ProductFactory(shopcart_id=shopcart.id, name="apple", price=1.0).create()
+        product = ProductFactory(shopcart_id=shopcart.id, name="pear", price=1.0)
+        product.create()
+        product = Product.find(product.id)
+        product.name = "apple"
+        self.assertRaises(DataValidationError, product.update)
+        self.assertEqual(Product.find(product.id).name, "pear")
+
+    def test_deserialize_merges_lines(self):
+        """It should merge the Products of a Shopcart that share a name and a price"""
+        shopcart = ShopCartFactory()
+        shopcart.products.append(ProductFactory(name="apple", price=1.0, quantity=1))
+        shopcart.create(shopcart.id)
+        apple_id = shopcart.products[0].id
+        data = {
+            "id": shopcart.id,
+            "products": [
+                # sent again without its id, with a duplicate of another
+                {"shopcart_id": None, "name": "apple", "price": 1.0, "quantity": 2},
+                {"shopcart_id": None, "name": "pear", "price": 1.0, "quantity": 1},
+                {"shopcart_id": None, "name": "pear", "price": 1.0, "quantity": 2},
+            ],
+        }
+        Shopcart.find_by_id(shopcart.id).deserialize(data)
+        products = {p.name: p for p in Product.find_by_shopcart(shopcart.id)}
+        self.assertEqual(products["apple"].id, apple_id)
+        self.assertEqual(products["apple"].quantity, 2)
+        self.assertEqual(products["pear"].quantity, 3)
+        # a Product renamed onto one that is removed
+        data = Shopcart.find_by_id(shopcart.id).serialize()
+        data["products"] = [dict(p, name="apple") for p in data["products"] if p["name"] == "pear"]
+        Shopcart.find_by_id(shopcart.id).deserialize(data)
+        products = Product.find_by_shopcart(shopcart.id)
+        self.assertEqual([(p.name, p.quantity) for p in products], [("apple", 3)])
+        self._assert_totals(shopcart.id)
+        self._assert_stats()
+
+    def test_add_quantity(self):
+        """It should change the quantity of a Product without reading it first"""
+        shopcart = ShopCartFactory()
+        shopcart.create(shopcart.id)
+        product = ProductFactory(shopcart_id=shopcart.id, quantity=2)
+        product.create()
+        shopcart_id, product_id = shopcart.id, product.id
+        row, statements = self._count_statements(
+            lambda: Product.add_quantity(shopcart_id, product_id, 3)
+        )
+        self.assertEqual(row["quantity"], 5)
+        self.assertEqual(row["version"], 2)
+        self.assertFalse([s for s in statements if s.startswith("SELECT")])
+        # the shopcart is locked before the product
+        self.assertTrue(statements[0].startswith("UPDATE shopcart"))
+        self.assertTrue(statements[1].startswith("UPDATE product"))
+        self.assertEqual(Product.add_quantity(shopcart.id, product_id, -5)["quantity"], 0)
+        self._assert_totals(shopcart.id)
+        self._assert_stats()
+        self.assertRaises(DataValidationError, Product.add_quantity, shopcart.id, product_id, -1)
+        self.assertRaises(
+            DataValidationError, Product.add_quantity, shopcart.id, product_id, Product.MAX_QUANTITY + 1
+        )
+        self.assertRaises(ConcurrencyError, Product.add_quantity, shopcart.id, product_id, 1, [1])
+        self.assertEqual(Product.add_quantity(shopcart.id, product_id, 1, [3])["version"], 4)
+        self.assertIsNone(Product.add_quantity(shopcart.id + 1, product_id, 1))
+        self.assertIsNone(Product.add_quantity(shopcart.id, 0, 1))
+        self.assertEqual(Product.find(product_id).quantity, 1)
+
+    def test_create_many_products(self):
+        """It should Create a list of products in one statement"""
+        shopcart = ShopCartFactory()
+        shopcart.create(shopcart.id)
+        data = [ProductFactory().serialize() for _ in range(3)]
+        products = Product.create_many(shopcart.id, data)
+        self.assertEqual(len(products), 3)
+        for product, product_data in zip(products, data):
+            self.assertIsNotNone(product.id)
+            self.assertEqual(product.shopcart_id, shopcart.id)
+            self.assertEqual(product.name, product_data["name"])
+        shopcart = Shopcart.find_by_id(shopcart.id)
+        self.assertEqual(len(shopcart.products), 3)
+        self.assertRaises(DataValidationError, Product.create_many, shopcart.id, [])
+        self.assertRaises(DataValidationError, Product.create_many, shopcart.id, [{}])
+
     def test_filter_shopcarts_by_product(self):
         """It should Filter shopcarts by given product"""
         shopcart = ShopCartFactory()
@@ -314,7 +918,7 @@ class TestShopCart(unittest.TestCase):
         shopcart2.products.append(product2)
         shopcart2.update()
         filtered_shopcarts = Shopcart.filter_by_product_name(product.name)
-        # self.assertEqual(len(filtered_shopcarts), 2)
+        self.assertEqual(len(filtered_shopcarts), 2)
         self.assertEqual(
             Shopcart.serialize(filtered_shopcarts[0]), Shopcart.serialize(shopcart)
         )
@@ -0,0 +1,72 @@
+"""
+Test cases for the instrumented connection pool
+"""
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from sqlalchemy import create_engine, exc
+from sqlalchemy.pool import NullPool
+from service.utils.pool_metrics import InstrumentedQueuePool, pool_status
+
+
+class TestPoolMetrics(TestCase):
+    """Pool Metrics Tests"""
+
+    def setUp(self):
+        self.engine = create_engine(
+            "sqlite://",
+            poolclass=InstrumentedQueuePool,
+            pool_size=1,
+            max_overflow=0,
+            pool_timeout=0.01,
+        )
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_record_checkouts(self):
+        """It should count checkouts and their wait times"""
+        for _ in range(3):
+            with self.engine.connect():
+                pass
+        report = pool_status(self.engine.pool)
+        self.assertEqual(report["checkouts"], 3)
+        self.assertEqual(report["timeouts"], 0)
+        self.assertEqual(sum(report["wait_ms_histogram"].values()), 3)
+        self.assertEqual(report["size"], 1)
+        self.assertEqual(report["checked_out"], 0)
+        # the pool opened its one connection for the first checkout
+        self.assertEqual(report["connects"], 1)
+
+    def test_wait_leaves_out_connect(self):
+        """It should not count the time to open a connection as waiting"""
+        connect = self.engine.dialect.connect
+
+        def slow_connect(*args, **kwargs):
+            time.sleep(0.05)
+            return connect(*args, **kwargs)
+
+        with patch.object(self.engine.dialect, "connect", slow_connect):
+            with self.engine.connect():
+                pass
+        report = pool_status(self.engine.pool)
+        self.assertEqual(report["connects"], 1)
+        self.assertGreaterEqual(report["connect_seconds_total"], 0.05)
+        self.assertLess(report["wait_seconds_total"], 0.05)
+
+    def test_record_timeouts(self):
+        """It should count checkouts that time out"""
+        with self.engine.connect():
+            report = pool_status(self.engine.pool)
+            self.assertEqual(report["checked_out"], 1)
+            self.assertRaises(exc.TimeoutError, self.engine.connect)
+        report = pool_status(self.engine.pool)
+        self.assertEqual(report["timeouts"], 1)
+        self.assertEqual(report["checkouts"], 1)
+
+    def test_other_pools(self):
+        """It should report pools without telemetry"""
+        engine = create_engine("sqlite://", poolclass=NullPool)
+        report = pool_status(engine.pool)
+        self.assertEqual(report["pool"], "NullPool")
+        self.assertNotIn("checkouts", report)
@@ -6,16 +6,18 @@ Test cases can be run with the following:
   coverage report -m
 """
 import os
+import json
 import logging
 from unittest import TestCase
+from concurrent.futures import ThreadPoolExecutor
 
 from mockito import when
 from mockito import mock
 import requests
 
 # from unittest.mock import MagicMock, patch
-from service import app, routes
-from service.models import db, Shopcart, Product
+from service import api, app, routes
+from service.models import db, Shopcart, Product, ProductStat
 from service.utils import status  # HTTP Status Codes
 from tests.factories import ShopCartFactory, ProductFactory
 from urllib.parse import quote_plus
@@ -62,14 +64,19 @@ class TestShopcartService(TestCase):
 
     def setUp(self):
         """Runs before each test"""
+        self.app_context = app.app_context()
+        self.app_context.push()
         db.session.query(Product).delete()
         db.session.query(Shopcart).delete()  # clean up the last tests
+        db.session.query(ProductStat).delete()
         db.session.commit()
+        routes.cart_cache.clear()
         self.client = app.test_client()
 
     def tearDown(self):
         """Runs once after each test case"""
         db.session.remove()
+        self.app_context.pop()
 
     ######################################################################
     #  H E L P E R   M E T H O D S
@@ -125,6 +132,78 @@ class TestShopcartService(TestCase):
         data = resp.get_json()
         self.assertEqual(data["id"], shopcart.id)
 
+    def test_get_shopcart_cached(self):
+        """It should serve repeat reads of a Shopcart from the cache until it changes"""
+        shopcart = self._create_shopcarts(1)[0]
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}")
+        self.assertEqual(resp.get_json()["products"], [])
+        # a change that bypasses the service is not seen while cached
+        product = ProductFactory(shopcart_id=shopcart.id)
+        product.create()
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}")
+        self.assertEqual(resp.get_json()["products"], [])
+        # a change through the service invalidates the cached copy
+        resp = self.client.post(
+            f"{BASE_URL}/{shopcart.id}/products", json=ProductFactory().serialize()
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}")
+        self.assertEqual(len(resp.get_json()["products"]), 2)
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/products")
+        self.assertEqual(len(resp.get_json()), 2)
+        resp = self.client.put(f"{BASE_URL}/{shopcart.id}/clear", json={})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/products")
+        self.assertEqual(resp.get_json(), [])
+        resp = self.client.delete(f"{BASE_URL}/{shopcart.id}")
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_shopcart_etag(self):
+        """It should answer a conditional GET of an unchanged Shopcart with 304"""
+        shopcart = self._create_shopcarts(1)[0]
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        etag = resp.headers["ETag"]
+        resp = self.client.get(
+            f"{BASE_URL}/{shopcart.id}", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.headers["ETag"], etag)
+        self.assertEqual(resp.get_data(), b"")
+        # answered from the database as well as from the cache
+        routes.cart_cache.clear()
+        resp = self.client.get(
+            f"{BASE_URL}/{shopcart.id}", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        resp = self.client.post(
+            f"{BASE_URL}/{shopcart.id}/products", json=ProductFactory().serialize()
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        resp = self.client.get(
+            f"{BASE_URL}/{shopcart.id}", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+        self.assertEqual(len(resp.get_json()["products"]), 1)
+
+    def test_get_recreated_shopcart_etag(self):
+        """It should not answer 304 for the ETag of a deleted Shopcart created again"""
+        shopcart = self._create_shopcarts(1)[0]
+        etag = self.client.get(f"{BASE_URL}/{shopcart.id}").headers["ETag"]
+        self.client.delete(f"{BASE_URL}/{shopcart.id}")
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}", json={"id": shopcart.id, "products": []})
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+        resp = self.client.put(
+            f"{BASE_URL}/{shopcart.id}", json={"id": shopcart.id, "products": []}, headers={"If-Match": etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
     def test_get_shopcart_not_found(self):
         """It should not Read a shopcart that is not found"""
         resp = self.client.get(f"{BASE_URL}/0", content_type="application/json")
@@ -144,6 +223,19 @@ class TestShopcartService(TestCase):
         )
         self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_create_product_with_bad_type(self):
+        """It should not Add a product whose fields have the wrong type"""
+        shopcart = self._create_shopcarts(1)[0]
+        new_product = ProductFactory().serialize()
+        new_product["quantity"] = "many"
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/products", json=new_product)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        data = resp.get_json()
+        self.assertEqual(data["error"], "Bad Request")
+        self.assertTrue(
+            data["message"].startswith("Invalid Product: body of request contained bad data - quantity")
+        )
+
     def test_create_shopcart_with_no_id(self):
         """Create a shopcart without an ud"""
         shopcart = ShopCartFactory()
@@ -232,7 +324,7 @@ class TestShopcartService(TestCase):
         shopcart = self._create_shopcarts(1)[0]
         product = ProductFactory()
         resp = self.client.post(
-            f"{BASE_URL}/123/products",
+            f"{BASE_URL}/123456/products",
             json=product.serialize(),
             content_type="application/json",
         )
@@ -251,6 +343,51 @@ class TestShopcartService(TestCase):
         self.assertEqual(data["quantity"], product.quantity)
         self.assertEqual(data["price"], product.price)
 
+    def test_add_product_batch(self):
+        """It should Add a list of products to a shopcart at once"""
+        shopcart = self._create_shopcarts(1)[0]
+        products = [product.serialize() for product in ProductFactory.create_batch(3)]
+        resp = self.client.post(f"{BASE_URL}/123456/products", json=products)
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/products", json=products)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertEqual(len(data), 3)
+        for created, product in zip(data, products):
+            self.assertIsNotNone(created["id"])
+            self.assertEqual(created["shopcart_id"], shopcart.id)
+            self.assertEqual(created["name"], product["name"])
+            self.assertEqual(created["quantity"], product["quantity"])
+            self.assertEqual(created["price"], product["price"])
+
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/products")
+        self.assertEqual(sorted(p["id"] for p in resp.get_json()), sorted(p["id"] for p in data))
+
+    def test_add_product_batch_bad_data(self):
+        """It should not Add any product of a list that has a bad product"""
+        shopcart = self._create_shopcarts(1)[0]
+        products = [product.serialize() for product in ProductFactory.create_batch(2)]
+        del products[1]["name"]
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/products", json=products)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/products", json=[])
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        products = [product.serialize() for product in ProductFactory.create_batch(2)]
+        for quantity in ("many", 2**40, -1, 1.5, True):
+            products[0]["quantity"] = quantity
+            resp = self.client.post(f"{BASE_URL}/{shopcart.id}/products", json=products)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        products[0]["quantity"] = 1
+        products[0]["name"] = "x" * 300
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/products", json=products)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("at most 260 characters", resp.get_json()["message"])
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/products", json=products[0])
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/products")
+        self.assertEqual(resp.get_json(), [])
+
     def test_get_shopcart_list(self):
         """It should Get a list of shopcarts"""
         self._create_shopcarts(5)
@@ -260,6 +397,51 @@ class TestShopcartService(TestCase):
         self.assertEqual(len(data), 5)
         resp = self.client.get(f"{BASE_URL}?id={data[0]['id']}")
 
+    def test_get_shopcart_list_paginated(self):
+        """It should page through the shopcarts with a cursor"""
+        shopcarts = self._create_shopcarts(5)
+        resp = self.client.get(BASE_URL, query_string="limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        ids = [shopcart["id"] for shopcart in resp.get_json()]
+        while "Link" in resp.headers:
+            link = resp.headers["Link"]
+            self.assertTrue(link.endswith('>; rel="next"'))
+            resp = self.client.get(link[1:link.index(">")])
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(resp.get_json()), 2)
+            ids.extend(shopcart["id"] for shopcart in resp.get_json())
+        self.assertEqual(ids, sorted(shopcart.id for shopcart in shopcarts))
+
+    def test_stream_shopcart_list(self):
+        """It should stream the shopcarts as NDJSON"""
+        shopcarts = self._create_shopcarts(3)
+        resp = self.client.post(
+            f"{BASE_URL}/{shopcarts[0].id}/products",
+            json=ProductFactory().serialize(),
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        resp = self.client.get(
+            BASE_URL, headers={"Accept": "application/x-ndjson"}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        lines = resp.get_data(as_text=True).splitlines()
+        data = [json.loads(line) for line in lines]
+        self.assertEqual([shopcart["id"] for shopcart in data], [s.id for s in shopcarts])
+        self.assertEqual(len(data[0]["products"]), 1)
+        self.assertEqual(data[1]["products"], [])
+        resp = self.client.get(BASE_URL, headers={"Accept": "application/json"})
+        self.assertEqual(resp.get_json(), data)
+
+    def test_get_shopcart_list_bad_page(self):
+        """It should not page shopcarts with a bad limit or cursor"""
+        resp = self.client.get(BASE_URL, query_string="limit=0")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(BASE_URL, query_string="limit=ten")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(BASE_URL, query_string="after=not-a-cursor")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_get_shopcart_by_id(self):
         """It should Get a shop cart by customer id"""
         shopcarts = self._create_shopcarts(3)
@@ -291,7 +473,8 @@ class TestShopcartService(TestCase):
         )
         self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
 
-        resp = self.client.get(f"{BASE_URL}/123/products")
+        # the factory hands out growing ids, so the next one is not taken
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id + 1}/products")
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
         resp = self.client.get(f"{BASE_URL}/{shopcart.id}/products")
@@ -300,6 +483,30 @@ class TestShopcartService(TestCase):
         data = resp.get_json()
         self.assertEqual(len(data), 2)
 
+    def test_read_items_paginated(self):
+        """It should page through the items of a given shopcart"""
+        shopcart = self._create_shopcarts(1)[0]
+        for product in ProductFactory.create_batch(3):
+            resp = self.client.post(
+                f"{BASE_URL}/{shopcart.id}/products",
+                json=product.serialize(),
+            )
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+        resp = self.client.get(
+            f"{BASE_URL}/{shopcart.id}/products", query_string="limit=2"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        first_page = resp.get_json()
+        self.assertEqual(len(first_page), 2)
+        link = resp.headers["Link"]
+        resp = self.client.get(link[1:link.index(">")])
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        second_page = resp.get_json()
+        self.assertEqual(len(second_page), 1)
+        self.assertNotIn("Link", resp.headers)
+        self.assertGreater(second_page[0]["id"], first_page[-1]["id"])
+
     def test_delete_product(self):
         """It should Delete a Product"""
         shopcart = self._create_shopcarts(1)[0]
@@ -366,7 +573,7 @@ class TestShopcartService(TestCase):
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
         updated_shopcart = resp.get_json()
         self.assertEqual(updated_shopcart["products"], [])
-        resp = self.client.put(f"{BASE_URL}/123/clear", json=test_shopcart.serialize())
+        resp = self.client.put(f"{BASE_URL}/123456/clear", json=test_shopcart.serialize())
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
     def test_get_product(self):
@@ -439,12 +646,105 @@ class TestShopcartService(TestCase):
         self.assertEqual(data["quantity"], 123)
         self.assertEqual(data["price"], 123)
         resp = self.client.put(
-            f"{BASE_URL}/{shopcart.id}/products/125",
+            f"{BASE_URL}/{shopcart.id}/products/0",
             content_type="application/json",
             json=data
         )
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_update_product_constraint_errors(self):
+        """It should tell apart the constraints an Update of a product breaks"""
+        shopcart = self._create_shopcarts(1)[0]
+        url = f"{BASE_URL}/{shopcart.id}/products"
+        first = self.client.post(url, json=ProductFactory().serialize()).get_json()
+        data = self.client.post(url, json=ProductFactory().serialize()).get_json()
+        product_url = f"{url}/{data['id']}"
+
+        resp = self.client.put(product_url, json=dict(data, name=first["name"], price=first["price"]))
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("name and price", resp.get_json()["message"])
+        resp = self.client.put(product_url, json=dict(data, shopcart_id=shopcart.id + 1000))
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIn(str(shopcart.id + 1000), resp.get_json()["message"])
+        resp = self.client.put(product_url, json=dict(data, shopcart_id=None))
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("shopcart_id must not be null", resp.get_json()["message"])
+        self.assertEqual(self.client.get(product_url).get_json(), data)
+
+    def test_update_shopcart_to_taken_id(self):
+        """It should not Update a shopcart to the id of another one"""
+        shopcarts = self._create_shopcarts(2)
+        data = {"id": shopcarts[1].id, "products": []}
+        resp = self.client.put(f"{BASE_URL}/{shopcarts[0].id}", json=data)
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+
+    def test_delete_product_if_match(self):
+        """It should only check the version of a deleted product with If-Match"""
+        shopcart = self._create_shopcarts(1)[0]
+        resp = self.client.post(
+            f"{BASE_URL}/{shopcart.id}/products", json=ProductFactory(quantity=2).serialize()
+        )
+        product_url = f"{BASE_URL}/{shopcart.id}/products/{resp.get_json()['id']}"
+        etag = resp.headers.get("ETag") or self.client.get(product_url).headers["ETag"]
+        self.client.patch(product_url, json={"quantity_delta": 1})
+        resp = self.client.delete(product_url, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(self.client.get(product_url).status_code, status.HTTP_200_OK)
+        resp = self.client.delete(product_url)
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(product_url).status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.client.delete(product_url)
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        summary = self.client.get(f"{BASE_URL}/{shopcart.id}/summary").get_json()
+        self.assertEqual((summary["line_count"], summary["item_count"]), (0, 0))
+
+    def test_update_product_if_match(self):
+        """It should only Update a product whose version matches If-Match"""
+        shopcart = self._create_shopcarts(1)[0]
+        resp = self.client.post(
+            f"{BASE_URL}/{shopcart.id}/products", json=ProductFactory().serialize()
+        )
+        product_url = f"{BASE_URL}/{shopcart.id}/products/{resp.get_json()['id']}"
+        resp = self.client.get(product_url)
+        etag = resp.headers["ETag"]
+        data = resp.get_json()
+
+        data["quantity"] = 7
+        resp = self.client.put(product_url, json=data, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+        data["quantity"] = 8
+        resp = self.client.put(product_url, json=data, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.client.get(product_url)
+        self.assertEqual(resp.get_json()["quantity"], 7)
+
+        resp = self.client.put(product_url, json=data, headers={"If-Match": "*"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["quantity"], 8)
+
+    def test_update_shopcart_if_match(self):
+        """It should only Update a shopcart whose version matches If-Match"""
+        shopcart = self._create_shopcarts(1)[0]
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}")
+        etag = resp.headers["ETag"]
+        data = resp.get_json()
+        data["products"] = [ProductFactory().serialize()]
+        resp = self.client.put(
+            f"{BASE_URL}/{shopcart.id}", json=data, headers={"If-Match": etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+        data["products"] = [ProductFactory().serialize()]
+        resp = self.client.put(
+            f"{BASE_URL}/{shopcart.id}", json=data, headers={"If-Match": etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}")
+        self.assertEqual(len(resp.get_json()["products"]), 1)
+
     def test_filter_shopcarts_by_product_name(self):
         """It should Filter Shop Carts by product name"""
         shopcarts = self._create_shopcarts(3)
@@ -492,6 +792,222 @@ class TestShopcartService(TestCase):
         resp = self.client.put(f"{BASE_URL}/{shopcart.id+100}", json=returned_shopcart)
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_pool_metrics(self):
+        """It should report the connection pool of the worker"""
+        resp = self.client.get("/api/metrics/pool")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["pid"], os.getpid())
+        self.assertIn("checked_out", data)
+        self.assertIn("wait_ms_histogram", data)
+
+    def test_concurrent_requests(self):
+        """It should serve many threads at once with a session per request"""
+        shopcarts = self._create_shopcarts(8)
+        checked_out = db.engine.pool.checkedout()
+        sessions = len(db.session.registry.registry)
+
+        def exercise(shopcart):
+            client = app.test_client()
+            url = f"{BASE_URL}/{shopcart.id}"
+            codes = []
+            for _ in range(5):
+                resp = client.post(f"{url}/products", json=ProductFactory().serialize())
+                codes.append(resp.status_code)
+                codes.append(client.get(url).status_code)
+                codes.append(client.get(f"{url}/products").status_code)
+                codes.append(client.get(BASE_URL).status_code)
+            resp = client.put(f"{url}/clear", json={})
+            codes.append(resp.status_code)
+            return codes
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(exercise, shopcarts))
+        for codes in results:
+            self.assertEqual(set(codes), {status.HTTP_200_OK, status.HTTP_201_CREATED})
+        # every request gave its session and its connection back
+        self.assertEqual(db.engine.pool.checkedout(), checked_out)
+        self.assertEqual(len(db.session.registry.registry), sessions)
+        for shopcart in shopcarts:
+            resp = self.client.get(f"{BASE_URL}/{shopcart.id}/products")
+            self.assertEqual(resp.get_json(), [])
+
+    def test_request_removes_session(self):
+        """It should remove the session of a request when it is torn down"""
+        shopcart = self._create_shopcarts(1)[0]
+        self.app_context.pop()
+        try:
+            db.session.remove()
+            resp = self.client.get(f"{BASE_URL}/{shopcart.id}")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertFalse(db.session.registry.has())
+        finally:
+            self.app_context.push()
+
+    def test_get_product_field_mask(self):
+        """It should only return the fields named in the mask header"""
+        shopcart = self._create_shopcarts(1)[0]
+        product = ProductFactory(shopcart_id=shopcart.id)
+        product.create()
+        url = f"{BASE_URL}/{shopcart.id}/products/{product.id}"
+        resp = self.client.get(url, headers={"X-Fields": "id,name"})
+        self.assertEqual(resp.get_json(), {"id": product.id, "name": product.name})
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}", headers={"X-Fields": "id"})
+        self.assertEqual(resp.get_json(), {"id": shopcart.id})
+
+    def test_get_shopcart_summary(self):
+        """It should summarize a Shopcart without returning its products"""
+        shopcart = self._create_shopcarts(1)[0]
+        products = [ProductFactory().serialize() for _ in range(2)]
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/products", json=products)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/summary")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        summary = resp.get_json()
+        self.assertEqual(summary["id"], shopcart.id)
+        self.assertEqual(summary["line_count"], 2)
+        self.assertEqual(summary["item_count"], sum(p["quantity"] for p in products))
+        self.assertAlmostEqual(
+            summary["total_price"], sum(p["price"] * p["quantity"] for p in products)
+        )
+        self.assertNotIn("products", summary)
+        self.assertEqual(resp.headers["ETag"], self.client.get(f"{BASE_URL}/{shopcart.id}").headers["ETag"])
+        resp = self.client.get(
+            f"{BASE_URL}/{shopcart.id}/summary", headers={"If-None-Match": resp.headers["ETag"]}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        resp = self.client.get(f"{BASE_URL}/0/summary")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.client.get(f"{BASE_URL}/abc/summary")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_shopcart_summary_past_integer_range(self):
+        """It should add products whose total quantity passes the Integer range"""
+        shopcart = self._create_shopcarts(1)[0]
+        products = [ProductFactory(quantity=quantity).serialize() for quantity in (2**31 - 1, 5)]
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/products", json=products)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        summary = self.client.get(f"{BASE_URL}/{shopcart.id}/summary").get_json()
+        self.assertEqual(summary["item_count"], 2**31 + 4)
+
+    def test_list_shopcart_summaries(self):
+        """It should summarize several Shopcarts at once"""
+        shopcarts = self._create_shopcarts(3)
+        ids = [shopcart.id for shopcart in shopcarts]
+        resp = self.client.get(
+            f"{BASE_URL}/summary", query_string=f"id={ids[2]},{ids[0]}&id={ids[0]}&id=0"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([summary["id"] for summary in data], sorted([ids[0], ids[2]]))
+        self.assertEqual(data[0]["line_count"], 0)
+        resp = self.client.get(f"{BASE_URL}/summary")
+        self.assertEqual(resp.get_json(), [])
+        resp = self.client.get(f"{BASE_URL}/summary", query_string="id=one")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_shopcarts(self):
+        """It should search the Shopcarts by product name, best match first"""
+        shopcarts = self._create_shopcarts(3)
+        for shopcart, name in zip(shopcarts, ("Banana Bread", "banana", "grape")):
+            ProductFactory(shopcart_id=shopcart.id, name=name).create()
+        resp = self.client.get(BASE_URL, query_string="name_prefix=BAN")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotIn("Link", resp.headers)
+        data = resp.get_json()
+        self.assertEqual([cart["id"] for cart in data], [shopcarts[1].id, shopcarts[0].id])
+        self.assertEqual(data[0]["products"][0]["name"], "banana")
+        resp = self.client.get(BASE_URL, query_string="q=ape&limit=1")
+        self.assertEqual([cart["id"] for cart in resp.get_json()], [shopcarts[2].id])
+        resp = self.client.get(BASE_URL, query_string="q=ape&name_prefix=gr")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(BASE_URL, query_string="q=%20")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_add_product_twice(self):
+        """It should add the quantity of a posted Product to the same line"""
+        shopcart = self._create_shopcarts(1)[0]
+        data = {"shopcart_id": shopcart.id, "name": "apple", "price": 1.5, "quantity": 2}
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/products", json=data)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        product_id = resp.get_json()["id"]
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/products", json=data)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["id"], product_id)
+        self.assertEqual(resp.get_json()["quantity"], 4)
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/products")
+        self.assertEqual(len(resp.get_json()), 1)
+
+    def test_change_product_quantity(self):
+        """It should add a quantity_delta to a Product"""
+        shopcart = self._create_shopcarts(1)[0]
+        product = ProductFactory(shopcart_id=shopcart.id, quantity=1)
+        product.create()
+        url = f"{BASE_URL}/{shopcart.id}/products/{product.id}"
+        self.client.get(f"{BASE_URL}/{shopcart.id}")  # cache the cart
+        resp = self.client.patch(url, json={"quantity_delta": 2})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["quantity"], 3)
+        etag = resp.headers["ETag"]
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}")
+        self.assertEqual(resp.get_json()["products"][0]["quantity"], 3)
+        resp = self.client.patch(url, json={"quantity_delta": -4})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        for delta in ("many", 1.5, True, 2**40):
+            resp = self.client.patch(url, json={"quantity_delta": delta})
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.patch(url, json={})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.patch(url, json={"quantity_delta": -1}, headers={"If-Match": '"1"'})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.client.patch(url, json={"quantity_delta": -1}, headers={"If-Match": etag})
+        self.assertEqual(resp.get_json()["quantity"], 2)
+        resp = self.client.patch(f"{BASE_URL}/{shopcart.id}/products/0", json={"quantity_delta": 1})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.client.patch(f"{BASE_URL}/0/products/{product.id}", json={"quantity_delta": 1})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_top_products_past_integer_range(self):
+        """It should add to a product whose total quantity passes the Integer range"""
+        shopcarts = self._create_shopcarts(2)
+        product = {"shopcart_id": None, "name": "apple", "price": 1.0, "quantity": 2**31 - 1}
+        resp = self.client.post(f"{BASE_URL}/{shopcarts[0].id}/products", json=product)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        resp = self.client.post(f"{BASE_URL}/{shopcarts[1].id}/products", json=dict(product, quantity=1))
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = self.client.get("/api/analytics/products").get_json()
+        self.assertEqual(data[0]["total_quantity"], 2**31)
+
+    def test_list_top_products(self):
+        """It should list the top products across all Shopcarts"""
+        for shopcart in self._create_shopcarts(3):
+            ProductFactory(shopcart_id=shopcart.id, name="apple", quantity=1).create()
+        ProductFactory(shopcart_id=shopcart.id, name="pear", quantity=9).create()
+        resp = self.client.get("/api/analytics/products")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([stat["name"] for stat in data], ["apple", "pear"])
+        self.assertEqual(data[0]["line_count"], 3)
+        resp = self.client.get("/api/analytics/products", query_string="order=total_quantity&limit=1")
+        data = resp.get_json()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]["name"], "pear")
+        self.assertEqual(data[0]["total_quantity"], 9)
+        resp = self.client.get("/api/analytics/products", query_string="order=name")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_swagger_spec(self):
+        """It should serve the cached OpenAPI spec with a strong ETag"""
+        resp = self.client.get("/api/swagger.json")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), json.loads(json.dumps(api.__schema__)))
+        etag, weak = resp.get_etag()
+        self.assertFalse(weak)
+        self.assertIn("max-age", resp.headers["Cache-Control"])
+        resp = self.client.get("/api/swagger.json", headers={"If-None-Match": f'"{etag}"'})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.get_data(), b"")
+
     def test_check_content_type(self):
         customApp = CustomFlask(import_name="Test App")
         with customApp.test_request_context():
@@ -0,0 +1,64 @@
+"""
+Test cases for the compiled serializers
+"""
+import json
+from unittest import TestCase
+from unittest.mock import patch
+from flask_restx import fields, marshal
+from service import routes
+from service.models import Product, Shopcart
+from service.utils import serializers
+from service.utils.serializers import Serializer, dumps
+from tests.factories import ProductFactory
+
+
+class TestSerializer(TestCase):
+    """Compiled Serializer Tests"""
+
+    def _shopcart(self):
+        """Returns a Shopcart with Products that was never saved"""
+        shopcart = Shopcart(id=3)
+        shopcart.products = [ProductFactory(shopcart_id=3) for _ in range(3)]
+        return shopcart
+
+    def test_same_as_marshal(self):
+        """It should build the same documents as marshal()"""
+        shopcart = self._shopcart()
+        expected = json.loads(json.dumps(marshal(shopcart.serialize(), routes.shopcart_model)))
+        self.assertEqual(routes.render_shopcart(shopcart), expected)
+        self.assertEqual(routes.render_shopcart(shopcart.serialize()), expected)
+        self.assertEqual(
+            list(routes.render_shopcart(shopcart)["products"][0]),
+            list(routes.product_model),
+        )
+
+    def test_missing_values(self):
+        """It should serialize missing values like marshal()"""
+        for data in (Product(), {}, None):
+            self.assertEqual(
+                routes.render_product(data), dict(marshal(data, routes.product_model))
+            )
+        self.assertEqual(routes.render_shopcart({"id": "4"}), {"id": 4, "products": None})
+
+    def test_many(self):
+        """It should serialize a list"""
+        products = [ProductFactory(), ProductFactory()]
+        self.assertEqual(
+            routes.render_product.many(products),
+            [routes.render_product(product) for product in products],
+        )
+
+    def test_unsupported_field(self):
+        """It should refuse fields it cannot compile"""
+        self.assertRaises(TypeError, Serializer, {"when": fields.DateTime()})
+        self.assertRaises(TypeError, Serializer, {"id": fields.Integer(default=1)})
+
+    def test_dumps(self):
+        """It should encode the same JSON with or without orjson"""
+        data = routes.render_shopcart(self._shopcart())
+        fast = dumps(data)
+        with patch.object(serializers, "orjson", None):
+            slow = dumps(data)
+        self.assertEqual(slow, (json.dumps(data) + "\n").encode())
+        self.assertTrue(fast.endswith(b"\n"))
+        self.assertEqual(json.loads(fast), json.loads(slow))